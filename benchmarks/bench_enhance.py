@@ -0,0 +1,64 @@
+"""
+Benchmark the parallel DE-GAN page enhancement stage against the number of workers.
+
+    python -m benchmarks.bench_enhance --pages 16 --workers 1 2 4
+"""
+import argparse
+import os
+import time
+from tempfile import TemporaryDirectory
+
+import numpy as np
+from PIL import Image
+
+from server.pdf_utils import process_images_with_multiprocessing
+
+
+def make_pages(directory, pages, height=1224, width=1008, seed=0):
+    """
+    Write noisy grayscale pages with dark text-like strokes.
+    """
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(pages):
+        page = np.full((height, width), 235, dtype=np.uint8)
+        for top in range(80, height - 80, 40):
+            for left in range(60, width - 120, 90):
+                page[top : top + 12, left : left + rng.integers(30, 80)] = 30
+        noise = rng.normal(0, 12, page.shape)
+        page = np.clip(page + noise, 0, 255).astype(np.uint8)
+        path = os.path.join(directory, f"page_{i + 1}.png")
+        Image.fromarray(page).save(path)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=16)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--task", default="deblur")
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmpdir:
+        image_paths = make_pages(tmpdir, args.pages)
+        baseline = None
+        for workers in args.workers:
+            start = time.perf_counter()
+            process_images_with_multiprocessing(
+                image_paths,
+                os.path.join(tmpdir, f"enhanced_{workers}"),
+                task=args.task,
+                workers=workers,
+            )
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(
+                f"{workers} workers: {elapsed:.1f}s, "
+                f"{args.pages / elapsed:.2f} pages/s, "
+                f"speedup x{baseline / elapsed:.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Throughput of extraction calls against a rate limited API (the fake one in
+benchmarks/fake_openai.py), comparing:
+
+- direct: a plain ChatOpenAI client with its built-in retries, as before
+  the scheduler,
+- scheduled: the same model through the scheduler's rate limiter,
+- fallback: the scheduler spilling over to gpt-3.5-turbo when saturated.
+
+    python -m benchmarks.bench_llm_scheduler --requests 200 --concurrency 64
+
+The fake API and the scheduler get the same --limits.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import threading
+import time
+from typing import Dict
+
+from benchmarks.synthetic import PARAGRAPH
+
+PRIMARY, FALLBACK = "gpt-4-turbo", "gpt-3.5-turbo"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_fake_api(limits: str, latency: float, port: int):
+    """Serve the fake API on `port` in a background thread, returning its app."""
+    import uvicorn
+
+    from benchmarks.fake_openai import create_app
+    from server.scheduler import parse_rate_limits
+
+    app = create_app(parse_rate_limits(limits), latency)
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return app
+
+
+async def run_mode(mode: str, args: argparse.Namespace) -> Dict[str, float]:
+    from langchain_openai import ChatOpenAI
+
+    import server.models as models
+    from server.extract_info import ExtractRequest, _extraction_chain
+    from server.scheduler import Scheduler, parse_rate_limits
+
+    if mode == "direct":
+        model = ChatOpenAI(model=PRIMARY, temperature=0)
+    else:
+        models.scheduler = Scheduler(
+            parse_rate_limits(args.limits),
+            fallback_model=FALLBACK if mode == "fallback" else None,
+        )
+        model = models.get_model(PRIMARY)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    # Distinct texts of about --prompt-tokens tokens, so nothing is cached
+    filler = " ".join([PARAGRAPH] * (args.prompt_tokens * 4 // len(PARAGRAPH) + 1))
+    failures = []
+
+    async def extract(index: int):
+        request = ExtractRequest(text=f"Page {index}\n{filler}", model_name=PRIMARY)
+        async with semaphore:
+            try:
+                await _extraction_chain(request, model).ainvoke({"text": request.text})
+            except Exception as e:
+                failures.append(type(e).__name__)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(extract(index) for index in range(args.requests)))
+    elapsed = time.perf_counter() - start
+    done = args.requests - len(failures)
+    return {
+        "done": done,
+        "failed": len(failures),
+        "seconds": elapsed,
+        "per_second": done / elapsed,
+    }
+
+
+async def run_modes(app, args: argparse.Namespace):
+    # One event loop for every mode, the shared connection pool is bound to it
+    for mode in args.modes:
+        app.state.reset()
+        result = await run_mode(mode, args)
+        counts = app.state.counts
+        print(
+            f"{mode:<10} {result['done']:4d} done {result['failed']:4d} failed "
+            f"in {result['seconds']:6.1f}s, {result['per_second']:5.2f} extractions/s, "
+            f"{sum(counts['rate_limited'].values()):5d} 429s, answered by {counts['ok']}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--prompt-tokens", type=int, default=1500)
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds per call")
+    parser.add_argument(
+        "--limits",
+        default=f"{PRIMARY}=300:600000,{FALLBACK}=600:900000",
+        help="model=requests:tokens per minute, comma separated",
+    )
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        choices=["direct", "scheduled", "fallback"],
+        default=["direct", "scheduled", "fallback"],
+    )
+    args = parser.parse_args()
+
+    port = _free_port()
+    # Read by server.constants, set before anything imports it
+    os.environ.update(
+        OPENAI_BASE_URL=f"http://127.0.0.1:{port}/v1",
+        OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "fake"),
+        LLM_RATE_LIMITS=args.limits,
+    )
+    app = start_fake_api(args.limits, args.latency, port)
+    asyncio.run(run_modes(app, args))
+
+
+if __name__ == "__main__":
+    main()
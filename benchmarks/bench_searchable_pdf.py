@@ -0,0 +1,118 @@
+"""
+Compare the two ways of writing the searchable PDF: one PDF per page through
+hOCR and `HocrParser.export_pdfa` then merged with PyPDF2 (the old
+`perform_ocr` path), against `SearchablePdfWriter` drawing every page on one
+canvas straight from the DocTR geometry.
+
+    python -m benchmarks.bench_searchable_pdf --pages 300
+
+Pages are generated on the fly, noisy scans with a DocTR page of word boxes
+each, so the benchmark needs DocTR installed but no OCR model.
+"""
+import argparse
+import os
+import time
+from tempfile import TemporaryDirectory
+from typing import Iterator, Tuple
+
+import numpy as np
+import pdfplumber
+from doctr.io import Block, Line, Page, Word
+from PyPDF2 import PdfFileMerger
+
+from benchmarks.bench_stages import peak_rss_mib
+from benchmarks.synthetic import ISSUES, PARAGRAPH
+from server.doctr_utils import HocrParser, SearchablePdfWriter
+
+WORDS = PARAGRAPH.split() + [word for issue in ISSUES for word in " ".join(issue).split()]
+
+
+def make_pages(
+    pages: int, height: int = 1584, width: int = 1224, seed: int = 0
+) -> Iterator[Tuple[np.ndarray, Page]]:
+    """
+    Yield (page image, DocTR page) pairs: 40 lines of dark word strokes on
+    noisy paper, the size of a letter page rendered at scale 2.
+    """
+    rng = np.random.default_rng(seed)
+    for index in range(pages):
+        image = np.full((height, width), 235, dtype=np.uint8)
+        lines = []
+        for top in range(80, height - 80, 36):
+            words, left = [], 60
+            while left < width - 160:
+                word_width = int(rng.integers(30, 110))
+                image[top : top + 14, left : left + word_width] = 30
+                geometry = (
+                    (left / width, top / height),
+                    ((left + word_width) / width, (top + 14) / height),
+                )
+                words.append(Word(str(rng.choice(WORDS)), 0.95, geometry))
+                left += word_width + 12
+            lines.append(Line(words))
+        image = np.clip(image + rng.normal(0, 12, image.shape), 0, 255).astype(np.uint8)
+        image = np.repeat(image[..., None], 3, axis=2)
+        yield image, Page(image, [Block(lines)], index, (height, width))
+
+
+def merged_path(pages: int, output_pdf: str):
+    parser = HocrParser()
+    merger = PdfFileMerger()
+    with TemporaryDirectory() as tmpdir:
+        for image, page in make_pages(pages):
+            page_pdf = os.path.join(tmpdir, f"{page.page_idx}.pdf")
+            parser.export_pdfa(page_pdf, hocr=page.export_as_xml()[1], image=image)
+            merger.append(page_pdf)
+        merger.write(output_pdf)
+
+
+def writer_path(pages: int, output_pdf: str):
+    with SearchablePdfWriter(output_pdf) as writer:
+        for image, page in make_pages(pages):
+            writer.add_page(page, image)
+
+
+def text_placement(pdf_path: str, pages: int):
+    with pdfplumber.open(pdf_path) as pdf:
+        return [
+            [(c["text"], round(c["x0"], 2), round(c["top"], 2)) for c in page.chars]
+            for page in pdf.pages[:pages]
+        ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument(
+        "--check-pages", type=int, default=3, help="pages compared for text placement"
+    )
+    args = parser.parse_args()
+
+    # Time generating the pages alone, so it can be taken out of both paths
+    start = time.perf_counter()
+    for _ in make_pages(args.pages):
+        pass
+    generation = time.perf_counter() - start
+
+    with TemporaryDirectory() as tmpdir:
+        outputs = {}
+        for name, write in (("merged", merged_path), ("writer", writer_path)):
+            outputs[name] = os.path.join(tmpdir, f"{name}.pdf")
+            start = time.perf_counter()
+            write(args.pages, outputs[name])
+            elapsed = time.perf_counter() - start - generation
+            print(
+                f"{name}: {elapsed:.1f}s, {args.pages / elapsed:.1f} pages/s, "
+                f"{os.path.getsize(outputs[name]) / 2**20:.1f} MiB, "
+                f"peak RSS so far {peak_rss_mib():.0f} MiB"
+            )
+        same = text_placement(outputs["merged"], args.check_pages) == text_placement(
+            outputs["writer"], args.check_pages
+        )
+        print(f"Same text placement on the first {args.check_pages} pages: {same}")
+
+
+if __name__ == "__main__":
+    main()
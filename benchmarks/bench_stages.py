@@ -0,0 +1,338 @@
+"""
+Time each stage of the pipeline separately on a synthetic scanned manual,
+reporting pages per second and peak RSS, and compare against a saved
+baseline to catch regressions before deploying.
+
+    python -m benchmarks.bench_stages --pages 20 --save benchmarks/baseline.json
+    python -m benchmarks.bench_stages --pages 20 --compare benchmarks/baseline.json
+
+Stages whose dependencies are not installed (DocTR, TensorFlow) are skipped.
+Peak RSS is measured over each stage alone, from the kernel's high-water
+mark reset before it, and includes what earlier stages still hold for
+later ones (the page images, the DocTR pages). Where the mark can't be
+reset (outside Linux) it is the process peak so far, so run one stage at a
+time with --stages there.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from tempfile import TemporaryDirectory
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pypdfium2 as pdfium
+
+from benchmarks.synthetic import ISSUES, PARAGRAPH, make_scanned_pdf
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "server", "DE_GAN"))
+
+# The fake model answers every chunk with the same extraction
+FAKE_RESPONSE = json.dumps(
+    [
+        {
+            "Page": 1,
+            "Troubleshooting Information": [
+                {"Issue": issue, "Solution": solution} for issue, solution in ISSUES
+            ],
+        }
+    ]
+)
+
+
+class Skipped(Exception):
+    pass
+
+
+class Context:
+    """
+    State handed from stage to stage, so later stages reuse earlier outputs.
+    """
+
+    def __init__(self, pdf_path: str, workdir: str, args: argparse.Namespace):
+        self.pdf_path = pdf_path
+        self.workdir = workdir
+        self.args = args
+        self.images: Optional[List[np.ndarray]] = None
+        self.doctr_pages: Optional[list] = None
+        self.page_pdfs: Optional[List[str]] = None
+        self.merged_pdf: Optional[str] = None
+
+    def gray_pages(self) -> List[np.ndarray]:
+        """
+        Grayscale pages in [0, 1] for DE_GAN, rendered here if the
+        rasterize stage did not run.
+        """
+        if self.images is not None:
+            return [image.mean(axis=2, dtype=np.float32) / 255.0 for image in self.images]
+        pdf = pdfium.PdfDocument(self.pdf_path)
+        try:
+            pages = []
+            for index in range(len(pdf)):
+                page = pdf[index]
+                gray = page.render(scale=2, grayscale=True).to_pil().convert("L")
+                pages.append(np.asarray(gray, dtype=np.float32) / 255.0)
+                page.close()
+            return pages
+        finally:
+            pdf.close()
+
+
+def reset_peak_rss() -> bool:
+    """
+    Reset the process' RSS high-water mark, so the next reading covers only
+    what runs in between. Returns False where the kernel doesn't allow it.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mib() -> float:
+    """The RSS high-water mark since the last reset, or since the process started."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def _timed(fn: Callable, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def stage_rasterize(ctx: Context) -> Dict[str, Tuple[int, float]]:
+    from server.doctr_utils import iter_pdf_pages
+
+    batches, seconds = _timed(lambda: list(iter_pdf_pages(ctx.pdf_path)))
+    ctx.images = [image for batch in batches for _, image in batch]
+    return {"rasterize": (len(ctx.images), seconds)}
+
+
+def stage_ocr(ctx: Context) -> Dict[str, Tuple[int, float]]:
+    from server.doctr_utils import get_predictor, load_models
+
+    if ctx.images is None:
+        raise Skipped("needs rasterize")
+    load_models(1)
+    with get_predictor() as model:
+        _, detection = _timed(model.det_predictor, ctx.images)
+        result, total = _timed(model, ctx.images)
+    ctx.doctr_pages = result.pages
+    pages = len(ctx.images)
+    return {"detection": (pages, detection), "recognition": (pages, total - detection)}
+
+
+def stage_export_pdfa(ctx: Context) -> Dict[str, Tuple[int, float]]:
+    from server.doctr_utils import HocrParser
+
+    if ctx.doctr_pages is None:
+        raise Skipped("needs ocr")
+    parser = HocrParser()
+    ctx.page_pdfs = [
+        os.path.join(ctx.workdir, f"{index}.pdf") for index in range(len(ctx.doctr_pages))
+    ]
+    start = time.perf_counter()
+    for page_pdf, page, image in zip(ctx.page_pdfs, ctx.doctr_pages, ctx.images):
+        parser.export_pdfa(page_pdf, hocr=page.export_as_xml()[1], image=image)
+    return {"export_pdfa": (len(ctx.page_pdfs), time.perf_counter() - start)}
+
+
+def stage_merge(ctx: Context) -> Dict[str, Tuple[int, float]]:
+    from PyPDF2 import PdfFileMerger
+
+    if ctx.page_pdfs is None:
+        raise Skipped("needs export_pdfa")
+    ctx.merged_pdf = os.path.join(ctx.workdir, "merged.pdf")
+    start = time.perf_counter()
+    merger = PdfFileMerger()
+    for page_pdf in ctx.page_pdfs:
+        merger.append(page_pdf)
+    merger.write(ctx.merged_pdf)
+    merger.close()
+    return {"merge": (len(ctx.page_pdfs), time.perf_counter() - start)}
+
+
+def stage_searchable_pdf(ctx: Context) -> Dict[str, Tuple[int, float]]:
+    from server.doctr_utils import SearchablePdfWriter
+
+    if ctx.doctr_pages is None:
+        raise Skipped("needs ocr")
+    start = time.perf_counter()
+    with SearchablePdfWriter(os.path.join(ctx.workdir, "searchable.pdf")) as writer:
+        for page, image in zip(ctx.doctr_pages, ctx.images):
+            writer.add_page(page, image)
+    return {"searchable_pdf": (len(ctx.doctr_pages), time.perf_counter() - start)}
+
+
+def stage_extract_text(ctx: Context) -> Dict[str, Tuple[int, float]]:
+    from server.doctr_utils import extract_text
+
+    if ctx.merged_pdf is None:
+        raise Skipped("needs merge")
+    _, seconds = _timed(extract_text, ctx.merged_pdf)
+    return {"extract_text": (len(ctx.page_pdfs), seconds)}
+
+
+def stage_tiling(ctx: Context) -> Dict[str, Tuple[int, float]]:
+    import tiling
+
+    pages = ctx.gray_pages()
+    start = time.perf_counter()
+    for page in pages:
+        grid = tiling.split(tiling.pad(page))
+        batch = tiling.to_batch(grid)
+        tiling.merge(batch.reshape(grid.shape))
+    return {"tiling": (len(pages), time.perf_counter() - start)}
+
+
+def stage_enhance(ctx: Context) -> Dict[str, Tuple[int, float]]:
+    from server.DE_GAN.enhance import enhance_images, get_generator
+
+    pages = ctx.gray_pages()[: ctx.args.enhance_pages]
+    get_generator(ctx.args.task)
+    _, seconds = _timed(enhance_images, ctx.args.task, pages)
+    return {"enhance": (len(pages), seconds)}
+
+
+def stage_llm(ctx: Context) -> Dict[str, Tuple[int, float]]:
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+    from server.extract_info import extract_chunked
+
+    if ctx.doctr_pages is not None:
+        from server.doctr_utils import page_text
+
+        page_texts = [page_text(page) for page in ctx.doctr_pages]
+    else:
+        # stand-in text of about the same length as an OCR'd manual page
+        page_texts = [" ".join([PARAGRAPH] * 8) for _ in range(ctx.args.pages)]
+    model = FakeListChatModel(responses=[FAKE_RESPONSE])
+    _, seconds = _timed(asyncio.run, extract_chunked(page_texts, model=model))
+    return {"llm": (len(page_texts), seconds)}
+
+
+STAGES = {
+    "rasterize": stage_rasterize,
+    "ocr": stage_ocr,
+    "export_pdfa": stage_export_pdfa,
+    "merge": stage_merge,
+    "searchable_pdf": stage_searchable_pdf,
+    "extract_text": stage_extract_text,
+    "tiling": stage_tiling,
+    "enhance": stage_enhance,
+    "llm": stage_llm,
+}
+
+
+def run(ctx: Context, stages: List[str]) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name in stages:
+        reset_peak_rss()
+        try:
+            rows = STAGES[name](ctx)
+        # DocTR raises OSError when its system libraries (pango) are missing
+        except (ImportError, OSError, Skipped) as e:
+            print(f"{name:<14} skipped ({e})")
+            continue
+        rss = peak_rss_mib()
+        for row, (pages, seconds) in rows.items():
+            results[row] = {
+                "pages": pages,
+                "seconds": round(seconds, 4),
+                "pages_per_second": round(pages / seconds, 3) if seconds > 0 else None,
+                "peak_rss_mib": round(rss, 1),
+            }
+            print(
+                f"{row:<14} {seconds:8.2f}s {results[row]['pages_per_second'] or 0:9.2f} pages/s"
+                f" {rss:9.1f} MiB peak RSS"
+            )
+    return results
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Stages that got slower or bigger than the baseline by more than `tolerance`.
+    """
+    regressions = []
+    for name, stage in results.items():
+        before = baseline.get("stages", {}).get(name)
+        if before is None:
+            continue
+        if before["pages_per_second"] and stage["pages_per_second"]:
+            ratio = stage["pages_per_second"] / before["pages_per_second"]
+            if ratio < 1 - tolerance:
+                regressions.append(f"{name}: {ratio:.2f}x the baseline pages/s")
+        if stage["peak_rss_mib"] > before["peak_rss_mib"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: peak RSS {stage['peak_rss_mib']} MiB, "
+                f"baseline {before['peak_rss_mib']} MiB"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--enhance-pages", type=int, default=2)
+    parser.add_argument("--task", default="deblur")
+    parser.add_argument("--blur", type=float, default=1.0)
+    parser.add_argument("--noise", type=float, default=10.0)
+    parser.add_argument("--skew", type=float, default=1.5)
+    parser.add_argument("--save", help="write the results as a baseline JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="allowed slowdown or growth, 0.2 is 20%%"
+    )
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as workdir:
+        pdf_path = make_scanned_pdf(
+            os.path.join(workdir, "scanned.pdf"),
+            pages=args.pages,
+            blur=args.blur,
+            noise=args.noise,
+            skew=args.skew,
+        )
+        results = run(Context(pdf_path, workdir, args), args.stages)
+
+    report = {
+        "pages": args.pages,
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "cpus": os.cpu_count(),
+        "stages": results,
+    }
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Cold start of the server: the time and peak RSS of importing each module in
+a fresh interpreter, and of a server process until `/ready` answers in each
+SERVER_ROLE. Heavy libraries an import pulled in are listed with it.
+
+    python -m benchmarks.bench_startup --save benchmarks/startup.json
+    python -m benchmarks.bench_startup --compare benchmarks/startup.json
+
+Modules whose dependencies are not installed are skipped. Role peak RSS is
+the server process only, the OCR worker processes it spawns are not counted.
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional
+
+MODULES = [
+    "server.constants",
+    "server.models",
+    "server.doctr_utils",
+    "server.extract_info",
+    "server.app",
+]
+HEAVY = ["torch", "tensorflow", "doctr", "openai", "langchain_openai"]
+
+# Run in a fresh interpreter: import the module, report time, peak RSS and heavy imports
+IMPORT_SNIPPET = """
+import json, resource, sys, time
+start = time.perf_counter()
+__import__(sys.argv[1])
+seconds = time.perf_counter() - start
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    "seconds": seconds,
+    "peak_rss_mib": peak / 2**20 if sys.platform == "darwin" else peak / 2**10,
+    "heavy": [name for name in sys.argv[2:] if name in sys.modules],
+}))
+"""
+
+
+def time_import(module: str) -> Optional[Dict]:
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET, module, *HEAVY],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        print(f"{module:<22} skipped ({result.stderr.strip().splitlines()[-1]})")
+        return None
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _peak_rss_mib(pid: int) -> Optional[float]:
+    """High-water mark of a running process, where /proc is available."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    return None
+
+
+def time_role(role: str, timeout: float, worker_url: str) -> Optional[Dict]:
+    """Start a server in `role` and wait for `/ready` to answer."""
+    port = _free_port()
+    env = dict(os.environ, SERVER_ROLE=role, OCR_WORKER_URL=worker_url)
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server.app:app", "--port", str(port)],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if server.poll() is not None:
+                print(f"role {role:<17} skipped (server exited with {server.returncode})")
+                return None
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/ready", timeout=1):
+                    seconds = time.perf_counter() - start
+                    return {"seconds": seconds, "peak_rss_mib": _peak_rss_mib(server.pid)}
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.1)
+        print(f"role {role:<17} skipped (not ready after {timeout:.0f}s)")
+        return None
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def run(args: argparse.Namespace) -> Dict[str, Dict]:
+    results = {}
+    for module in args.modules:
+        result = time_import(module)
+        if result is not None:
+            results[module] = result
+    for role in args.roles:
+        result = time_role(role, args.timeout, args.worker_url)
+        if result is not None:
+            results[f"role {role}"] = result
+    for name, result in results.items():
+        rss = result["peak_rss_mib"]
+        print(
+            f"{name:<22} {result['seconds']:7.2f}s"
+            f" {rss or 0:8.1f} MiB peak RSS {' '.join(result.get('heavy', []))}"
+        )
+    return results
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Imports and roles that got slower or bigger than the baseline by more than `tolerance`.
+    """
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get("startup", {}).get(name)
+        if before is None:
+            continue
+        if result["seconds"] > before["seconds"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: {result['seconds']:.2f}s, baseline {before['seconds']:.2f}s"
+            )
+        if (
+            result["peak_rss_mib"]
+            and before["peak_rss_mib"]
+            and result["peak_rss_mib"] > before["peak_rss_mib"] * (1 + tolerance)
+        ):
+            regressions.append(
+                f"{name}: peak RSS {result['peak_rss_mib']:.1f} MiB, "
+                f"baseline {before['peak_rss_mib']:.1f} MiB"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    parser.add_argument(
+        "--roles", nargs="*", choices=["all", "api", "worker"], default=["api", "all"]
+    )
+    parser.add_argument("--timeout", type=float, default=300, help="seconds to wait for /ready")
+    parser.add_argument(
+        "--worker-url",
+        default="http://127.0.0.1:8001",
+        help="OCR_WORKER_URL for the api role, not called until a PDF is uploaded",
+    )
+    parser.add_argument("--save", help="write the results as a baseline JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="allowed slowdown or growth, 0.2 is 20%%"
+    )
+    args = parser.parse_args()
+
+    results = run(args)
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "cpus": os.cpu_count(),
+        "startup": results,
+    }
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Compare the original loop-based DE-GAN tiling (float64, list copies) with the
+view-based tiling module, in time and peak allocation per page.
+
+    python -m benchmarks.bench_tiling --pages 20
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "server", "DE_GAN"))
+
+import tiling  # noqa: E402
+
+
+def legacy_roundtrip(page):
+    """Pad, split and merge a page the way enhance.py used to."""
+    h = ((page.shape[0] // 256) + 1) * 256
+    w = ((page.shape[1] // 256) + 1) * 256
+    padding = np.zeros((h, w)) + 1
+    padding[: page.shape[0], : page.shape[1]] = page
+    tiles = []
+    for ii in range(0, h, 256):
+        for iii in range(0, w, 256):
+            tiles.append(padding.reshape(h, w, 1)[ii : ii + 256, iii : iii + 256, :])
+    tiles = np.array([tile.reshape(1, 256, 256, 1) for tile in np.array(tiles)])
+    image = np.zeros((h, w, 1))
+    ind = 0
+    for ii in range(0, h, 256):
+        for iii in range(0, w, 256):
+            image[ii : ii + 256, iii : iii + 256, :] = tiles[ind]
+            ind = ind + 1
+    return np.array(image)[: page.shape[0], : page.shape[1]]
+
+
+def tiling_roundtrip(page):
+    """Pad, split and merge a page with the tiling module."""
+    grid = tiling.split(tiling.pad(page))
+    batch = tiling.to_batch(grid)
+    return tiling.merge(batch.reshape(grid.shape))[: page.shape[0], : page.shape[1]]
+
+
+def measure(roundtrip, pages):
+    tracemalloc.start()
+    start = time.perf_counter()
+    for page in pages:
+        roundtrip(page)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed / len(pages), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--height", type=int, default=2448)
+    parser.add_argument("--width", type=int, default=2016)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    pages = [
+        rng.random((args.height, args.width), dtype=np.float32)
+        for _ in range(args.pages)
+    ]
+    for name, roundtrip in (("legacy", legacy_roundtrip), ("tiling", tiling_roundtrip)):
+        per_page, peak = measure(roundtrip, pages)
+        print(f"{name}: {per_page * 1000:.1f} ms/page, peak {peak / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+A local OpenAI-compatible chat completions API that simulates rate limits,
+to exercise the LLM scheduler without paying for (or being throttled by)
+the real one.
+
+    python -m benchmarks.fake_openai --port 8100 --limits "gpt-4-turbo=300:600000"
+    OPENAI_BASE_URL=http://localhost:8100/v1 OPENAI_API_KEY=fake python -m server.app
+
+Each model gets a requests and a tokens per minute budget, charged with the
+prompt plus `max_tokens` (1000 when not set) like the real API. Calls over
+budget get a 429 with a Retry-After header. Every call answers with the
+same extraction after `--latency` seconds, streamed or not.
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, Tuple
+from uuid import uuid4
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from benchmarks.bench_stages import FAKE_RESPONSE
+from server.scheduler import BURST_SECONDS, TokenBucket, parse_rate_limits
+from server.text_utils import estimate_tokens
+
+
+def create_app(
+    limits: Dict[str, Tuple[float, float]],
+    latency: float = 1.0,
+    burst_seconds: float = BURST_SECONDS,
+) -> FastAPI:
+    app = FastAPI(title="Fake OpenAI")
+    buckets: Dict[str, Tuple[TokenBucket, TokenBucket]] = {}
+    counts: Dict[str, Dict[str, int]] = {"ok": {}, "rate_limited": {}}
+
+    def reset():
+        """Full budgets and no calls counted, between benchmark runs."""
+        buckets.clear()
+        for model, (requests, tokens) in limits.items():
+            buckets[model] = (
+                TokenBucket(requests, burst_seconds),
+                TokenBucket(tokens, burst_seconds),
+            )
+        for per_model in counts.values():
+            per_model.clear()
+
+    reset()
+    app.state.reset = reset
+    app.state.counts = counts
+
+    def rate_limited(model: str, tokens: int) -> float:
+        """Seconds until the call fits the budget, or 0 once it is charged."""
+        if model not in buckets:
+            return 0.0
+        requests, token_bucket = buckets[model]
+        wait = max(requests.wait_time(1), token_bucket.wait_time(tokens))
+        if wait > 0:
+            return wait
+        requests.take(1)
+        token_bucket.take(tokens)
+        return 0.0
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body["model"]
+        prompt = "\n".join(str(message.get("content", "")) for message in body["messages"])
+        prompt_tokens = estimate_tokens(prompt)
+        retry_after = rate_limited(model, prompt_tokens + (body.get("max_tokens") or 1000))
+        if retry_after:
+            counts["rate_limited"][model] = counts["rate_limited"].get(model, 0) + 1
+            return JSONResponse(
+                {
+                    "error": {
+                        "message": f"Rate limit reached for {model}.",
+                        "type": "requests",
+                        "code": "rate_limit_exceeded",
+                    }
+                },
+                status_code=429,
+                headers={"retry-after": f"{retry_after:.3f}"},
+            )
+
+        await asyncio.sleep(latency)
+        counts["ok"][model] = counts["ok"].get(model, 0) + 1
+        completion_id, created = f"chatcmpl-{uuid4().hex}", int(time.time())
+        completion_tokens = estimate_tokens(FAKE_RESPONSE)
+        if not body.get("stream"):
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": FAKE_RESPONSE},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            }
+
+        async def events():
+            for start in range(0, len(FAKE_RESPONSE), 16):
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "delta": {"content": FAKE_RESPONSE[start : start + 16]},
+                            "finish_reason": None,
+                        }
+                    ],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    def stats():
+        return counts
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument(
+        "--limits",
+        default="gpt-4-turbo=300:600000,gpt-3.5-turbo=600:900000",
+        help="model=requests:tokens per minute, comma separated",
+    )
+    parser.add_argument("--latency", type=float, default=1.0)
+    args = parser.parse_args()
+    uvicorn.run(
+        create_app(parse_rate_limits(args.limits), args.latency), port=args.port
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Generate synthetic "old scanned" manuals: text and table pages drawn with
+reportlab, rasterized, degraded with blur, noise and skew, and written back
+as an image-only PDF, the way a scanner would produce them.
+
+    python -m benchmarks.synthetic manual.pdf --pages 20 --blur 1.5 --noise 12 --skew 2
+"""
+import argparse
+import os
+import textwrap
+from io import BytesIO
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import pypdfium2 as pdfium
+from PIL import Image
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen.canvas import Canvas
+
+ISSUES = [
+    ("Belt slips during use", "Tighten the drive belt tension bolt a quarter turn."),
+    ("Display stays blank", "Replace the 4 AA batteries in the console."),
+    ("Pedals squeak", "Lubricate the pedal shaft with silicone spray."),
+    ("Machine wobbles", "Adjust the leveling feet until all four touch the floor."),
+    ("Heart rate not shown", "Grip both sensors firmly and keep hands still."),
+    ("Error code E2", "Check the speed sensor cable at the lower frame."),
+]
+
+PARAGRAPH = (
+    "Before each use examine the machine for worn or loose parts. Do not use "
+    "the machine until damaged parts are replaced. Keep children away from "
+    "the machine at all times. Always unplug the power cord before cleaning."
+)
+
+
+def _draw_text_page(pdf: Canvas, page_number: int, rng: np.random.Generator):
+    width, height = letter
+    pdf.setFont("Helvetica-Bold", 16)
+    pdf.drawString(72, height - 72, f"Owner's Manual - Section {page_number}")
+    pdf.setFont("Helvetica", 11)
+    y = height - 110
+    words = PARAGRAPH.split()
+    while y > 120:
+        line = " ".join(rng.choice(words, size=rng.integers(9, 13)))
+        pdf.drawString(72, y, line.capitalize() + ".")
+        y -= 16
+    pdf.setFont("Helvetica", 9)
+    pdf.drawString(width / 2 - 10, 48, str(page_number))
+
+
+def _draw_table_page(pdf: Canvas, page_number: int, rng: np.random.Generator):
+    width, height = letter
+    pdf.setFont("Helvetica-Bold", 16)
+    pdf.drawString(72, height - 72, "Troubleshooting")
+    rows = [ISSUES[i] for i in rng.permutation(len(ISSUES))]
+    top, row_height = height - 110, 40
+    left, middle, right = 72, 280, width - 72
+    pdf.setLineWidth(1)
+    for i in range(len(rows) + 2):
+        pdf.line(left, top - i * row_height, right, top - i * row_height)
+    bottom = top - (len(rows) + 1) * row_height
+    for x in (left, middle, right):
+        pdf.line(x, top, x, bottom)
+    pdf.setFont("Helvetica-Bold", 11)
+    pdf.drawString(left + 6, top - 25, "Problem")
+    pdf.drawString(middle + 6, top - 25, "Solution")
+    pdf.setFont("Helvetica", 9)
+    for i, (issue, solution) in enumerate(rows, start=1):
+        y = top - i * row_height - 25
+        pdf.drawString(left + 6, y, issue)
+        for j, line in enumerate(textwrap.wrap(solution, 45)):
+            pdf.drawString(middle + 6, y - j * 11, line)
+    pdf.setFont("Helvetica", 9)
+    pdf.drawString(width / 2 - 10, 48, str(page_number))
+
+
+def _blur(page: np.ndarray, sigma: float) -> np.ndarray:
+    """
+    Separable Gaussian blur, as a slightly out of focus scan.
+    """
+    if sigma <= 0:
+        return page
+    radius = int(3 * sigma) + 1
+    x = np.arange(-radius, radius + 1)
+    kernel = np.exp(-(x**2) / (2 * sigma**2))
+    kernel /= kernel.sum()
+    height, width = page.shape
+    padded = np.pad(page, radius, mode="edge")
+    rows = sum(w * padded[:, i : i + width] for i, w in enumerate(kernel))
+    return sum(w * rows[i : i + height] for i, w in enumerate(kernel))
+
+
+def degrade(
+    page: np.ndarray,
+    rng: np.random.Generator,
+    blur: float = 1.0,
+    noise: float = 10.0,
+    skew: float = 1.5,
+) -> np.ndarray:
+    """
+    Turn a clean grayscale page into a scan: a random skew of up to `skew`
+    degrees, a Gaussian blur of `blur` pixels, yellowed paper and sensor noise.
+    """
+    image = Image.fromarray(page)
+    if skew:
+        image = image.rotate(
+            rng.uniform(-skew, skew), resample=Image.BILINEAR, fillcolor=255
+        )
+    scan = _blur(np.asarray(image, dtype=np.float32), blur)
+    scan = scan * 0.85 + 20 + rng.normal(0, noise, scan.shape)
+    return np.clip(scan, 0, 255).astype(np.uint8)
+
+
+def make_scanned_pdf(
+    output_pdf: str,
+    pages: int = 10,
+    blur: float = 1.0,
+    noise: float = 10.0,
+    skew: float = 1.5,
+    table_every: int = 3,
+    resolution: int = 150,
+    seed: int = 0,
+) -> str:
+    """
+    Write an image-only PDF of `pages` degraded pages, every `table_every`th
+    one a troubleshooting table, rendered at `resolution` dpi.
+    """
+    rng = np.random.default_rng(seed)
+    with TemporaryDirectory() as tmpdir:
+        clean_pdf = os.path.join(tmpdir, "clean.pdf")
+        pdf = Canvas(clean_pdf, pagesize=letter)
+        for page_number in range(1, pages + 1):
+            if table_every and page_number % table_every == 0:
+                _draw_table_page(pdf, page_number, rng)
+            else:
+                _draw_text_page(pdf, page_number, rng)
+            pdf.showPage()
+        pdf.save()
+
+        document = pdfium.PdfDocument(clean_pdf)
+        scanned = Canvas(output_pdf, pagesize=letter, pageCompression=1)
+        try:
+            for index in range(len(document)):
+                page = document[index]
+                bitmap = page.render(scale=resolution / 72, grayscale=True)
+                clean = np.asarray(bitmap.to_pil().convert("L"))
+                page.close()
+                scan = degrade(clean, rng, blur=blur, noise=noise, skew=skew)
+                buffer = BytesIO()
+                Image.fromarray(scan).save(buffer, format="JPEG", quality=80)
+                buffer.seek(0)
+                scanned.drawImage(ImageReader(buffer), 0, 0, *letter)
+                scanned.showPage()
+        finally:
+            document.close()
+        scanned.save()
+    return output_pdf
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("output_pdf")
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--blur", type=float, default=1.0)
+    parser.add_argument("--noise", type=float, default=10.0)
+    parser.add_argument("--skew", type=float, default=1.5)
+    parser.add_argument("--table-every", type=int, default=3)
+    parser.add_argument("--resolution", type=int, default=150)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    make_scanned_pdf(
+        args.output_pdf,
+        pages=args.pages,
+        blur=args.blur,
+        noise=args.noise,
+        skew=args.skew,
+        table_every=args.table_every,
+        resolution=args.resolution,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 import sys
 import os
+import threading
 
 sys.path.append("server/DE_GAN")
 sys.path.append(os.getcwd())
@@ -10,57 +11,114 @@ import numpy as np
 from models.models import *
 from PIL import Image
 from utils import *
+import tiling
 
 input_size = (256, 256, 1)
 
+# Tiles sent to the generator per predict step
+BATCH_SIZE = int(os.getenv("ENHANCE_BATCH_SIZE", "16"))
+# Pixels shared by neighbouring tiles, blended to hide seams (0 for none)
+TILE_OVERLAP = int(os.getenv("ENHANCE_TILE_OVERLAP", "0"))
 
-def enhance_image(task, deg_image_path, output_dir, save_path):
-    generator = None
-    if task == "binarize":
-        generator = generator_model(biggest_layer=1024)
-        generator.load_weights("weights/binarization_generator_weights.h5")
-    else:
-        if task == "deblur":
-            generator = generator_model(biggest_layer=1024)
-            generator.load_weights("weights/deblur_weights.h5")
-        else:
-            if task == "unwatermark":
-                generator = generator = generator_model(biggest_layer=512)
-                generator.load_weights("weights/watermark_rem_weights.h5")
-            else:
-                print("Wrong task, please specify a correct task !")
-
-    deg_image = Image.open(deg_image_path)  # /255.0
-    deg_image = deg_image.convert("L")
-    gray_path = os.path.join(output_dir, "curr_image.png")
-    deg_image.save(gray_path)
-
-    test_image = plt.imread(gray_path)
 
-    h = ((test_image.shape[0] // 256) + 1) * 256
-    w = ((test_image.shape[1] // 256) + 1) * 256
+# The weights ship in server/weights, next to this package
+WEIGHTS_DIR = os.getenv(
+    "DE_GAN_WEIGHTS_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "weights"),
+)
 
-    test_padding = np.zeros((h, w)) + 1
-    test_padding[: test_image.shape[0], : test_image.shape[1]] = test_image
+# task: (biggest layer, weights file)
+TASKS = {
+    "binarize": (1024, "binarization_generator_weights.h5"),
+    "deblur": (1024, "deblur_weights.h5"),
+    "unwatermark": (512, "watermark_rem_weights.h5"),
+}
 
-    test_image_p = split2(test_padding.reshape(1, h, w, 1), 1, h, w)
-    predicted_list = []
-    for l in range(test_image_p.shape[0]):
-        predicted_list.append(
-            generator.predict(test_image_p[l].reshape(1, 256, 256, 1))
-        )
+_generators = {}
+_generators_lock = threading.Lock()
 
-    predicted_image = np.array(predicted_list)  # .reshape()
-    predicted_image = merge_image2(predicted_image, h, w)
 
-    predicted_image = predicted_image[: test_image.shape[0], : test_image.shape[1]]
-    predicted_image = predicted_image.reshape(
-        predicted_image.shape[0], predicted_image.shape[1]
-    )
+def load_generator(task):
+    if task not in TASKS:
+        raise ValueError(
+            f"Wrong task {task}, please specify one of {list(TASKS.keys())}"
+        )
+    biggest_layer, weights = TASKS[task]
+    generator = generator_model(biggest_layer=biggest_layer)
+    generator.load_weights(os.path.join(WEIGHTS_DIR, weights))
+    return generator
+
+
+def get_generator(task):
+    """
+    The generator for a task, built and loaded once per process.
+    """
+    with _generators_lock:
+        if task not in _generators:
+            _generators[task] = load_generator(task)
+        return _generators[task]
+
+
+def init_worker(tasks=("deblur",)):
+    """
+    Pool initializer, so each worker process holds its own warm generators.
+    """
+    for task in tasks:
+        get_generator(task)
+
+
+def enhance_images(
+    task, test_images, generator=None, batch_size=BATCH_SIZE, overlap=TILE_OVERLAP
+):
+    """
+    Enhance grayscale page images (floats in [0, 1]).
+    The tiles of all pages are stacked and run through the generator
+    in batches of `batch_size`, instead of one predict call per tile.
+    Pages are tiled as views and reassembled in float32 without per-tile copies.
+    """
+    if generator is None:
+        generator = get_generator(task)
+    stride = tiling.TILE - overlap
+
+    grids = [
+        tiling.split(
+            tiling.pad(np.asarray(test_image, dtype=np.float32), stride=stride),
+            stride=stride,
+        )
+        for test_image in test_images
+    ]
+    counts = [grid.shape[0] * grid.shape[1] for grid in grids]
+    batch = np.empty((sum(counts), tiling.TILE, tiling.TILE, 1), dtype=np.float32)
+    start = 0
+    for grid, count in zip(grids, counts):
+        tiling.to_batch(grid, out=batch[start : start + count])
+        start += count
+
+    predicted_tiles = generator.predict(batch, batch_size=batch_size)
+
+    predicted_images = []
+    start = 0
+    for test_image, grid, count in zip(test_images, grids, counts):
+        page_tiles = predicted_tiles[start : start + count].reshape(grid.shape)
+        start += count
+        predicted_image = tiling.merge(page_tiles, stride=stride)
+        predicted_image = predicted_image[: test_image.shape[0], : test_image.shape[1]]
+
+        if task == "binarize":
+            bin_thresh = 0.95
+            predicted_image = (predicted_image > bin_thresh).astype(np.float32)
+        predicted_images.append(predicted_image)
+
+    return predicted_images
+
+
+def enhance_image(task, deg_image_path, output_dir, save_path, batch_size=BATCH_SIZE):
+    deg_image = Image.open(deg_image_path)
+    deg_image = deg_image.convert("L")
+    # Same values plt.imread gave for the grayscale PNG, without the scratch file
+    test_image = np.asarray(deg_image, dtype=np.float32) / 255.0
 
-    if task == "binarize":
-        bin_thresh = 0.95
-        predicted_image = (predicted_image[:, :] > bin_thresh) * 1
+    predicted_image = enhance_images(task, [test_image], batch_size=batch_size)[0]
 
     final_path = os.path.join(output_dir, save_path)
     plt.imsave(final_path, predicted_image, cmap="gray")
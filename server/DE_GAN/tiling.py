@@ -0,0 +1,88 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+TILE = 256
+
+
+def padded_size(size, tile=TILE, stride=None):
+    """
+    Smallest size >= `size` covered exactly by tiles placed every `stride` pixels.
+    """
+    stride = stride or tile
+    if size <= tile:
+        return tile
+    return tile + -(-(size - tile) // stride) * stride
+
+
+def pad(image, tile=TILE, stride=None, fill=1.0):
+    """
+    Pad a 2D page on the bottom and right with `fill` (white) so it tiles exactly.
+    The dtype of the page is kept.
+    """
+    h, w = image.shape[:2]
+    padded = np.full(
+        (padded_size(h, tile, stride), padded_size(w, tile, stride)),
+        fill,
+        dtype=image.dtype,
+    )
+    padded[:h, :w] = image
+    return padded
+
+
+def split(padded, tile=TILE, stride=None):
+    """
+    Tiles of a padded page as a (rows, cols, tile, tile) view, nothing is copied.
+    With a `stride` smaller than `tile` the tiles overlap.
+    """
+    stride = stride or tile
+    if stride == tile:
+        h, w = padded.shape
+        return padded.reshape(h // tile, tile, w // tile, tile).swapaxes(1, 2)
+    return sliding_window_view(padded, (tile, tile))[::stride, ::stride]
+
+
+def _blend_window(tile, overlap):
+    """
+    Weights ramping up over the overlapping margins so seams fade into each other.
+    """
+    ramp = np.ones(tile, dtype=np.float32)
+    if overlap:
+        edge = np.linspace(0, 1, overlap + 2, dtype=np.float32)[1:-1]
+        ramp[:overlap] = edge
+        ramp[-overlap:] = edge[::-1]
+    return np.outer(ramp, ramp)
+
+
+def merge(tiles, stride=None):
+    """
+    Reassemble (rows, cols, tile, tile) tiles into the padded page.
+    Non-overlapping tiles are written in a single vectorized copy,
+    overlapping ones are blended across their seams.
+    """
+    rows, cols, tile, _ = tiles.shape
+    stride = stride or tile
+    if stride == tile:
+        return tiles.swapaxes(1, 2).reshape(rows * tile, cols * tile)
+
+    weights = _blend_window(tile, tile - stride)
+    shape = (tile + (rows - 1) * stride, tile + (cols - 1) * stride)
+    page = np.zeros(shape, dtype=np.float32)
+    norm = np.zeros(shape, dtype=np.float32)
+    for row in range(rows):
+        for col in range(cols):
+            top, left = row * stride, col * stride
+            page[top : top + tile, left : left + tile] += tiles[row, col] * weights
+            norm[top : top + tile, left : left + tile] += weights
+    return page / norm
+
+
+def to_batch(tiles, out=None):
+    """
+    Copy (rows, cols, tile, tile) tiles into a contiguous (n, tile, tile, 1)
+    model input, or into `out` if given, with one write.
+    """
+    rows, cols, tile, _ = tiles.shape
+    if out is None:
+        out = np.empty((rows * cols, tile, tile, 1), dtype=np.float32)
+    out.reshape(rows, cols, tile, tile)[...] = tiles
+    return out
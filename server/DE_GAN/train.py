@@ -9,6 +9,7 @@ import os.path
 import imageio
 from utils import *
 from models.models import *
+import tiling
 
 
 input_size = (256,256,1)
@@ -86,22 +87,11 @@ def predic(generator, epoch):
         watermarked_image_path = ('CLEAN/VALIDATION/DATA/'+ str(i+1) + '.png')
         test_image = plt.imread(watermarked_image_path)
         
-        h =  ((test_image.shape [0] // 256) +1)*256 
-        w =  ((test_image.shape [1] // 256 ) +1)*256
-        
-        test_padding=np.zeros((h,w))+1
-        test_padding[:test_image.shape[0],:test_image.shape[1]]=test_image
-        
-        test_image_p=split2(test_padding.reshape(1,h,w,1),1,h,w)
-        predicted_list=[]
-        for l in range(test_image_p.shape[0]):
-            predicted_list.append(generator.predict(test_image_p[l].reshape(1,256,256,1)))
-        
-        predicted_image = np.array(predicted_list)#.reshape()
-        predicted_image=merge_image2(predicted_image,h,w)
+        test_tiles=tiling.split(tiling.pad(test_image.astype(np.float32)))
+        predicted_tiles = generator.predict(tiling.to_batch(test_tiles), batch_size=16)
+        predicted_image=tiling.merge(predicted_tiles.reshape(test_tiles.shape))
         
         predicted_image=predicted_image[:test_image.shape[0],:test_image.shape[1]]
-        predicted_image=predicted_image.reshape(predicted_image.shape[0],predicted_image.shape[1])
         predicted_image = (predicted_image[:,:])*255
         
         predicted_image =predicted_image.astype(np.uint8)
@@ -1,11 +1,14 @@
 import tempfile
-import os
+import json
 from typing import Optional, Dict, Any
 
-from fastapi import APIRouter, File, Form, HTTPException, UploadFile
-from server.extract_info import ExtractResponse, extract_from_pdf
+from fastapi import APIRouter, File, Form, HTTPException, Response, UploadFile
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from server.jobs import Job, QueueFullError, job_manager
+from server.metrics import server_timing
 from server.models import DEFAULT_MODEL
-from server.constants import TEMP_DIR
+from server.workspace import UploadTooLargeError, Workspace, spool_upload
 
 router = APIRouter(
     prefix="/extract",
@@ -14,21 +17,97 @@ router = APIRouter(
 )
 
 
-@router.post("", response_model=ExtractResponse)
+async def receive_upload(file: Optional[UploadFile]) -> Workspace:
+    """
+    Stream the uploaded PDF into a new workspace, removed again if anything fails.
+    """
+    if file is None:
+        raise HTTPException(status_code=422, detail="No PDF file provided.")
+    try:
+        job_manager.check_capacity()
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    workspace = Workspace()
+    try:
+        await spool_upload(file, workspace.input_pdf)
+    except UploadTooLargeError as e:
+        workspace.cleanup()
+        raise HTTPException(status_code=413, detail=str(e))
+    except BaseException:
+        workspace.cleanup()
+        raise
+    return workspace
+
+
+@router.post("", response_model=Job, status_code=202)
 async def extract(
     *,
     file: UploadFile = File(None),
     model_name: Optional[str] = Form(DEFAULT_MODEL),
-) -> ExtractResponse:
+) -> Job:
     """
-    Extract structured data from text.
+    Queue a PDF for extraction and return the job to poll.
     """
-    if file is None:
-        raise HTTPException(status_code=422, detail="No PDF file provided.")
-    # Save the uploaded file to a temporary file
-    temp_path = os.path.join(TEMP_DIR, "temp.pdf")
-    with open(temp_path, "wb") as temp:
-        contents = await file.read()
-        temp.write(contents)
+    workspace = await receive_upload(file)
+    try:
+        return job_manager.submit(workspace, model_name)
+    except QueueFullError as e:
+        workspace.cleanup()
+        raise HTTPException(status_code=429, detail=str(e))
+
+
+@router.post("/stream")
+async def extract_stream(
+    *,
+    file: UploadFile = File(None),
+    model_name: Optional[str] = Form(DEFAULT_MODEL),
+) -> StreamingResponse:
+    """
+    Extract structured data from a PDF, streaming progress as NDJSON:
+    one `ocr` event per page read, a `compaction` event with the tokens
+    saved on the page texts, one `extraction` event per chunk extracted
+    and a final `done` (or `error`) event with the result.
+    """
+    workspace = await receive_upload(file)
+    try:
+        events = job_manager.stream(workspace, model_name)
+    except QueueFullError as e:
+        workspace.cleanup()
+        raise HTTPException(status_code=429, detail=str(e))
+
+    async def ndjson():
+        async for event in events:
+            yield json.dumps(event) + "\n"
+
+    # frees the job slot even if the body is never read
+    return StreamingResponse(
+        ndjson(),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(job_manager.release, workspace),
+    )
+
 
-    return await extract_from_pdf(file=temp_path, model_name=model_name)
+@router.get("/{job_id}", response_model=Job)
+async def get_job(job_id: str, response: Response) -> Job:
+    """
+    Get the status of an extraction job, and its result once done.
+    A finished job's stage timings are also sent in the Server-Timing header.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    if job.timings:
+        response.headers["Server-Timing"] = server_timing(job.timings)
+    return job
+
+
+@router.get("/{job_id}/searchable.pdf")
+async def get_searchable_pdf(job_id: str) -> FileResponse:
+    """
+    Download the searchable PDF of a finished job, written with
+    EXPORT_SEARCHABLE_PDF and kept as long as the job is.
+    """
+    path = job_manager.searchable_pdf(job_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="No searchable PDF for this job.")
+    return FileResponse(path, media_type="application/pdf", filename="searchable.pdf")
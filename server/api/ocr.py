@@ -0,0 +1,50 @@
+import json
+from typing import Any, Dict
+
+from fastapi import APIRouter, File, HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from server.api.extract import receive_upload
+from server.extract_info import ocr_config
+from server.jobs import QueueFullError, job_manager
+
+router = APIRouter(
+    prefix="/ocr",
+    tags=["ocr"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+@router.get("/config")
+async def config() -> Dict[str, Any]:
+    """
+    The settings of this worker that affect the page texts, which an API
+    process keys its OCR cache with.
+    """
+    return ocr_config()
+
+
+@router.post("")
+async def ocr(*, file: UploadFile = File(None)) -> StreamingResponse:
+    """
+    Read a PDF's pages for an API process (SERVER_ROLE=api), streaming
+    NDJSON: `{"pages": [...], "texts": [...], "total": n}` for each batch
+    of pages read, then `{"timings": {...}}` (or `{"error": ...}`).
+    """
+    workspace = await receive_upload(file)
+    try:
+        events = job_manager.read_pages(workspace)
+    except QueueFullError as e:
+        workspace.cleanup()
+        raise HTTPException(status_code=429, detail=str(e))
+
+    async def ndjson():
+        async for event in events:
+            yield json.dumps(event) + "\n"
+
+    # frees the job slot even if the body is never read
+    return StreamingResponse(
+        ndjson(),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(job_manager.release, workspace),
+    )
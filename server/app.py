@@ -1,13 +1,22 @@
+import asyncio
 import logging
 import os
+import time
 from pathlib import Path
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from langserve import add_routes
 
-from server.api import extract
+from server.api import extract, ocr
+from server.cache import ocr_cache, result_cache
+from server.constants import MAX_UPLOAD_BYTES, SERVER_ROLE
+from server.jobs import job_manager
+from server.llm_cache import llm_cache
+from server.metrics import REGISTRY
+from server.workspace import body_too_large, sweep_periodically
 from server.extract_info import (
     ExtractRequest,
     ExtractResponse,
@@ -36,31 +45,96 @@ if ORIGINS:
     )
 
 
+@app.middleware("http")
+async def add_server_timing(request: Request, call_next):
+    """Add the time spent handling the request to the Server-Timing header."""
+    start = time.perf_counter()
+    response = await call_next(request)
+    app_timing = f"app;dur={(time.perf_counter() - start) * 1000:.1f}"
+    existing = response.headers.get("Server-Timing")
+    response.headers["Server-Timing"] = (
+        f"{existing}, {app_timing}" if existing else app_timing
+    )
+    return response
+
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """
+    Refuse bodies whose Content-Length is over MAX_UPLOAD_BYTES before they
+    are read. Uploads sent without one are cut off while they are spooled.
+    """
+    if body_too_large(request.headers.get("content-length")):
+        return JSONResponse(
+            {"detail": f"Upload exceeds the limit of {MAX_UPLOAD_BYTES} bytes."},
+            status_code=413,
+        )
+    return await call_next(request)
+
+
+@app.on_event("startup")
+async def start_workers() -> None:
+    """Start the OCR workers and load their models in the background."""
+    job_manager.start()
+    app.state.warm_up = asyncio.create_task(job_manager.warm_up())
+    # Clean up files left behind by crashed workers and old artifacts
+    app.state.sweeper = asyncio.create_task(sweep_periodically())
+
+
+@app.on_event("shutdown")
+def stop_workers() -> None:
+    app.state.sweeper.cancel()
+    job_manager.shutdown()
+
+
 @app.get("/ready")
 def ready() -> str:
+    if not job_manager.ready:
+        raise HTTPException(status_code=503, detail="OCR models are still loading.")
     return "ok"
 
 
-# Include API endpoints for extractor definitions
-app.include_router(extract.router)
+@app.get("/cache/stats")
+def cache_stats() -> dict:
+    return {
+        "ocr": ocr_cache.stats(),
+        "results": result_cache.stats(),
+        "llm": llm_cache.stats(),
+    }
 
-add_routes(
-    app,
-    extraction_runnable.with_types(
-        input_type=ExtractRequest, output_type=ExtractResponse
-    ),
-    path="/extract_text",
-    enabled_endpoints=["invoke", "batch"],
-)
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics() -> PlainTextResponse:
+    """Pipeline metrics in the Prometheus text format."""
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+# Processes running OCR can read pages for API-only ones
+if SERVER_ROLE != "api":
+    app.include_router(ocr.router)
+
+if SERVER_ROLE != "worker":
+    # Include API endpoints for extractor definitions
+    app.include_router(extract.router)
+
+    add_routes(
+        app,
+        extraction_runnable.with_types(
+            input_type=ExtractRequest, output_type=ExtractResponse
+        ),
+        path="/extract_text",
+        enabled_endpoints=["invoke", "batch", "stream"],
+    )
 
-# Serve the frontend
-UI_DIR = str(ROOT / "ui")
+    # Serve the frontend
+    UI_DIR = str(ROOT / "ui")
 
-if os.path.exists(UI_DIR):
-    app.mount("/", StaticFiles(directory=UI_DIR, html=True), name="ui")
-else:
-    logger.warning("No UI directory found, serving API only.")
+    if os.path.exists(UI_DIR):
+        app.mount("/", StaticFiles(directory=UI_DIR, html=True), name="ui")
+    else:
+        logger.warning("No UI directory found, serving API only.")
 
 
 if __name__ == "__main__":
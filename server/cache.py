@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+from server.constants import (
+    CACHE_DIR,
+    OCR_CACHE_MAX_BYTES,
+    PAGE_CACHE_MAX_BYTES,
+    RESULT_CACHE_MAX_BYTES,
+)
+from server.metrics import CACHE_REQUESTS
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Hash a file in chunks so large PDFs are never fully loaded in memory.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(*parts: Any) -> str:
+    """
+    Build a stable key from the document hash and the pipeline configuration.
+    """
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """
+    JSON values stored one file per key, evicted least recently used first
+    once the directory grows past `max_bytes`. The directory is created
+    with the first entry.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.name = os.path.basename(os.path.normpath(directory))
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+            # Touch the entry so eviction sees it as recently used
+            os.utime(path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.record(hit=False)
+            return None
+        self.record(hit=True)
+        return value
+
+    def record(self, hit: bool):
+        """
+        Count a lookup, for lookups that may not reach `get`.
+        """
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        CACHE_REQUESTS.inc(cache=self.name, result="hit" if hit else "miss")
+
+    def peek(self, key: str) -> Optional[Any]:
+        """
+        Read an entry without counting it as a hit or refreshing it.
+        """
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _entries(self) -> List[os.DirEntry]:
+        try:
+            with os.scandir(self.directory) as entries:
+                return [entry for entry in entries if entry.name.endswith(".json")]
+        except FileNotFoundError:
+            return []
+
+    def keys(self) -> List[str]:
+        return [entry.name[: -len(".json")] for entry in self._entries()]
+
+    def put(self, key: str, value: Any):
+        path = self._path(key)
+        os.makedirs(self.directory, exist_ok=True)
+        # Write then rename so readers never see a partial entry
+        tmp_path = f"{path}.{uuid4()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for entry in self._entries():
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def stats(self) -> Dict[str, int]:
+        entries = self._entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(entries),
+            "bytes": sum(entry.stat().st_size for entry in entries),
+        }
+
+
+# Per-page OCR text, keyed by document hash and OCR configuration
+ocr_cache = DiskCache(os.path.join(CACHE_DIR, "ocr"), OCR_CACHE_MAX_BYTES)
+# DocTR results of single pages, see `server.page_store`
+page_cache = DiskCache(os.path.join(CACHE_DIR, "pages"), PAGE_CACHE_MAX_BYTES)
+# Extraction results, keyed by the OCR key plus the model and prompt
+result_cache = DiskCache(os.path.join(CACHE_DIR, "results"), RESULT_CACHE_MAX_BYTES)
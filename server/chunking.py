@@ -0,0 +1,127 @@
+import json
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from server.text_utils import estimate_tokens
+
+PAGE_KEY_PATTERN = re.compile(r"^page([ _]?(number|no|num))?$", re.IGNORECASE)
+
+
+def chunk_pages(
+    page_texts: Sequence[str],
+    token_budget: int,
+    page_numbers: Optional[Sequence[int]] = None,
+) -> List[List[Tuple[int, str]]]:
+    """
+    Group consecutive pages into chunks of at most `token_budget` tokens.
+    Chunks always end on a page boundary, a page larger than the budget
+    gets a chunk of its own. Pages are numbered from 1 unless `page_numbers`
+    is given.
+    """
+    if page_numbers is None:
+        page_numbers = range(1, len(page_texts) + 1)
+    chunks = []
+    chunk: List[Tuple[int, str]] = []
+    chunk_tokens = 0
+    for page_number, text in zip(page_numbers, page_texts):
+        tokens = estimate_tokens(text)
+        if chunk and chunk_tokens + tokens > token_budget:
+            chunks.append(chunk)
+            chunk, chunk_tokens = [], 0
+        chunk.append((page_number, text))
+        chunk_tokens += tokens
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def _page_key(item: Dict[str, Any]) -> Optional[str]:
+    for key in item:
+        if PAGE_KEY_PATTERN.match(key.strip()):
+            return key
+    return None
+
+
+def _page_number(item: Dict[str, Any]) -> Optional[int]:
+    key = _page_key(item)
+    if key is None:
+        return None
+    match = re.search(r"\d+", str(item[key]))
+    return int(match.group()) if match else None
+
+
+def _items(output: Any) -> List[Dict[str, Any]]:
+    """
+    Flatten one chunk's JSON into a list of items.
+    Models return either a list of items, a single item, or a single item
+    wrapping a list of them.
+    """
+    if isinstance(output, list):
+        return [item for item in output if isinstance(item, dict)]
+    if not isinstance(output, dict):
+        return []
+    if _page_key(output) is None:
+        lists = [value for value in output.values() if isinstance(value, list)]
+        if len(lists) == 1 and all(isinstance(item, dict) for item in lists[0]):
+            return lists[0]
+    return [output]
+
+
+def _fingerprint(value: Any) -> str:
+    """Identity of an entry for duplicate removal, ignoring case and spacing."""
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    if isinstance(value, dict):
+        value = {k.lower(): _fingerprint(v) for k, v in value.items()}
+    elif isinstance(value, list):
+        value = [_fingerprint(v) for v in value]
+    return json.dumps(value, sort_keys=True)
+
+
+def _dedupe(values: List[Any]) -> List[Any]:
+    seen = set()
+    unique = []
+    for value in values:
+        fingerprint = _fingerprint(value)
+        if fingerprint not in seen:
+            seen.add(fingerprint)
+            unique.append(value)
+    return unique
+
+
+def _is_wrapper(item: Dict[str, Any]) -> bool:
+    """Whether an item only wraps lists for its page, e.g. `{"Page": 3, "Issues": [...]}`."""
+    page_key = _page_key(item)
+    values = [value for key, value in item.items() if key != page_key]
+    return bool(values) and all(isinstance(value, list) for value in values)
+
+
+def merge_extractions(outputs: Sequence[Any]) -> List[Dict[str, Any]]:
+    """
+    Merge the JSON extracted from each chunk, ordered by page number.
+    Every item is kept, only duplicates (ignoring case and spacing) are
+    dropped. Items that only wrap lists for a page are combined per page,
+    their lists concatenated without duplicates. Items without a page
+    number are kept after the numbered ones.
+    """
+    numbered: List[Tuple[int, Dict[str, Any]]] = []
+    wrappers: Dict[int, Dict[str, Any]] = {}
+    unnumbered = []
+    for output in outputs:
+        for item in _items(output):
+            page_number = _page_number(item)
+            if page_number is None:
+                unnumbered.append(item)
+            elif not _is_wrapper(item):
+                numbered.append((page_number, item))
+            elif page_number not in wrappers:
+                wrappers[page_number] = dict(item)
+                numbered.append((page_number, wrappers[page_number]))
+            else:
+                merged = wrappers[page_number]
+                for key, value in item.items():
+                    if isinstance(value, list):
+                        merged[key] = _dedupe(merged.get(key, []) + value)
+    # a stable sort keeps the model's order within a page
+    numbered.sort(key=lambda pair: pair[0])
+    return _dedupe([item for _, item in numbered]) + _dedupe(unnumbered)
@@ -0,0 +1,224 @@
+"""
+Extract troubleshooting information from many PDFs at once, without the API.
+
+    python -m server.cli "archive/**/*.pdf" manuals/ --output results.jsonl
+
+Each document's result is appended to the output as one JSON line. Progress
+is checkpointed to a manifest next to it, so an interrupted run picks up
+where it stopped when started again with the same output. Documents that
+failed, or changed since, are extracted again.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional
+
+from server.cache import file_sha256
+from server.constants import LLM_CONCURRENCY
+from server.extract_info import limit_llm_calls, stream_extract_from_pdf
+from server.jobs import init_worker
+from server.models import DEFAULT_MODEL
+
+logger = logging.getLogger(__name__)
+
+
+def find_pdfs(inputs: List[str]) -> List[str]:
+    """
+    The PDFs under the given directories (recursively) or matching the given
+    globs, except searchable PDFs the server wrote beside their input.
+    """
+    paths = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "**", "*.pdf")
+        paths.extend(
+            path
+            for path in glob.glob(pattern, recursive=True)
+            if os.path.isfile(path)
+            and path.lower().endswith(".pdf")
+            and not path.lower().endswith(".searchable.pdf")
+        )
+    return sorted(set(os.path.abspath(path) for path in paths))
+
+
+class Manifest:
+    """
+    Which documents are done, and how much of the output file they account for.
+    Written atomically after every document.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # None until the first checkpoint, an existing output is then left alone
+        self.output_bytes: Optional[int] = None
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            self.output_bytes = saved["output_bytes"]
+            self.documents = saved["documents"]
+
+    def is_done(self, path: str, sha256: str) -> bool:
+        entry = self.documents.get(path)
+        return entry is not None and entry["status"] == "done" and entry["sha256"] == sha256
+
+    def record(self, path: str, sha256: str, status: str, output_bytes: int):
+        self.documents[path] = {"sha256": sha256, "status": status}
+        self.output_bytes = output_bytes
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"output_bytes": output_bytes, "documents": self.documents}, f)
+        os.replace(tmp_path, self.path)
+
+
+async def _extract_document(
+    path: str, model_name: str, executor: ProcessPoolExecutor
+) -> Dict[str, Any]:
+    record: Dict[str, Any] = {"file": path, "status": "done", "pages": None}
+    try:
+        # no searchable PDF is written next to the archived documents
+        async for event in stream_extract_from_pdf(path, model_name, executor, export=False):
+            if event["event"] == "ocr":
+                record["pages"] = event["pages"]
+            elif event["event"] == "compaction":
+                # one event per window of pages
+                record["tokens_saved"] = (
+                    record.get("tokens_saved", 0) + event["tokens_before"] - event["tokens_after"]
+                )
+            elif event["event"] == "done":
+                record["data"] = event["data"]
+                record["timings"] = event["timings"]
+    except Exception as e:
+        logger.exception("Extraction of %s failed", path)
+        record["status"] = "failed"
+        record["error"] = str(e)
+    return record
+
+
+async def run(
+    paths: List[str],
+    output: str,
+    manifest_path: str,
+    model_name: str = DEFAULT_MODEL,
+    workers: int = os.cpu_count() or 1,
+    max_documents: Optional[int] = None,
+    llm_concurrency: int = LLM_CONCURRENCY,
+) -> Dict[str, int]:
+    """
+    Extract every document not already done according to the manifest,
+    `max_documents` at a time with OCR spread over `workers` processes.
+    Returns how many documents were done, failed and skipped.
+    """
+    limit_llm_calls(llm_concurrency)
+    manifest = Manifest(manifest_path)
+    if manifest.output_bytes is not None:
+        # Drop output written after the last checkpoint, it is redone below
+        with open(output, "a", encoding="utf-8") as out:
+            out.truncate(manifest.output_bytes)
+
+    loop = asyncio.get_running_loop()
+    counts = {"done": 0, "failed": 0, "skipped": 0}
+    pending = []
+    for path in paths:
+        sha256 = await loop.run_in_executor(None, file_sha256, path)
+        if manifest.is_done(path, sha256):
+            counts["skipped"] += 1
+        else:
+            pending.append((path, sha256))
+    logger.info("%d documents to extract, %d already done", len(pending), counts["skipped"])
+
+    # Enough documents in flight to keep every worker busy while others wait on the LLM
+    semaphore = asyncio.Semaphore(max_documents or workers * 2)
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=get_context("spawn"),
+        initializer=init_worker,
+        initargs=(workers,),
+    )
+
+    async def extract(path: str, sha256: str):
+        async with semaphore:
+            start = time.perf_counter()
+            record = await _extract_document(path, model_name, executor)
+            return record, sha256, time.perf_counter() - start
+
+    tasks = [asyncio.ensure_future(extract(path, sha256)) for path, sha256 in pending]
+    try:
+        with open(output, "a", encoding="utf-8") as out:
+            for finished, task in enumerate(asyncio.as_completed(tasks), start=1):
+                record, sha256, elapsed = await task
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                os.fsync(out.fileno())
+                manifest.record(record["file"], sha256, record["status"], out.tell())
+                counts[record["status"]] += 1
+                logger.info(
+                    "[%d/%d] %s %s in %.1fs (%s pages)",
+                    finished,
+                    len(tasks),
+                    record["status"],
+                    os.path.basename(record["file"]),
+                    elapsed,
+                    record["pages"],
+                )
+    finally:
+        for task in tasks:
+            task.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("inputs", nargs="+", help="directories or glob patterns of PDFs")
+    parser.add_argument("--output", "-o", default="results.jsonl")
+    parser.add_argument(
+        "--manifest", help="checkpoint file, defaults to the output path plus .manifest.json"
+    )
+    parser.add_argument("--model-name", default=DEFAULT_MODEL)
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="OCR worker processes"
+    )
+    parser.add_argument(
+        "--max-documents", type=int, help="documents in flight, defaults to twice the workers"
+    )
+    parser.add_argument(
+        "--llm-concurrency",
+        type=int,
+        default=LLM_CONCURRENCY,
+        help="LLM calls in flight across all documents",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    paths = find_pdfs(args.inputs)
+    if not paths:
+        parser.error("no PDF found")
+    counts = asyncio.run(
+        run(
+            paths,
+            args.output,
+            args.manifest or f"{args.output}.manifest.json",
+            model_name=args.model_name,
+            workers=args.workers,
+            max_documents=args.max_documents,
+            llm_concurrency=args.llm_concurrency,
+        )
+    )
+    logger.info(
+        "%d done, %d failed, %d skipped", counts["done"], counts["failed"], counts["skipped"]
+    )
+    if counts["failed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
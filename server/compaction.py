@@ -0,0 +1,84 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Sequence, Set, Tuple
+
+from server.constants import COMPACT_MIN_PAGE_FRACTION
+from server.text_utils import estimate_tokens
+
+# Running headers and footers are looked for in this many lines at the
+# top and at the bottom of each page
+EDGE_LINES = 3
+# Longer lines are body text, even when it repeats
+MAX_FURNITURE_CHARS = 120
+
+SPACES = re.compile(r"[ \t\f\v\u00a0]+")
+# A word broken over two lines, "adjust-\nment". Nothing tells it from a
+# compound broken at its hyphen, so "drive-\nbelt" is joined as "drivebelt"
+# too; a capitalized continuation, "self-\nContained", is left as it is
+HYPHENATED_BREAK = re.compile(r"(\w)-\n(?=[a-z])")
+DIGITS = re.compile(r"\d+")
+ALPHANUMERIC = re.compile(r"[^\W_]")
+
+
+def clean_text(text: str) -> str:
+    """
+    Collapse runs of spaces, drop blank lines and lines without a single
+    letter or digit (rules, specks), and join words hyphenated across lines.
+    """
+    lines = (SPACES.sub(" ", line).strip() for line in text.splitlines())
+    text = "\n".join(line for line in lines if ALPHANUMERIC.search(line))
+    return HYPHENATED_BREAK.sub(r"\1", text)
+
+
+def _line_key(line: str) -> str:
+    # Page numbers and dates change from page to page, the rest of a header does not
+    return DIGITS.sub("#", line.lower())
+
+
+def _edges(lines: List[str]) -> List[Tuple[int, str]]:
+    return [
+        (index, line)
+        for index, line in enumerate(lines)
+        if index < EDGE_LINES or index >= len(lines) - EDGE_LINES
+    ]
+
+
+def repeated_lines(
+    pages: Sequence[List[str]], min_fraction: float = COMPACT_MIN_PAGE_FRACTION
+) -> Set[str]:
+    """
+    Keys of the short lines found at the top or bottom of at least
+    `min_fraction` of the pages, and of at least 3 pages.
+    """
+    counts: Counter = Counter()
+    for lines in pages:
+        counts.update(
+            {_line_key(line) for _, line in _edges(lines) if len(line) <= MAX_FURNITURE_CHARS}
+        )
+    min_pages = max(3, math.ceil(min_fraction * len(pages)))
+    return {key for key, count in counts.items() if count >= min_pages}
+
+
+def compact_pages(
+    page_texts: Sequence[str], min_fraction: float = COMPACT_MIN_PAGE_FRACTION
+) -> Tuple[List[str], Dict[str, int]]:
+    """
+    Shrink page texts before prompting: whitespace and noise lines cleaned
+    up, running headers, footers and page numbers removed. Pages are kept
+    in place, even when nothing is left of them, so page numbers still
+    match. Returns the texts and their estimated tokens before and after.
+    """
+    pages = [clean_text(text).split("\n") for text in page_texts]
+    repeated = repeated_lines(pages, min_fraction)
+    compacted = []
+    for lines in pages:
+        furniture = {index for index, line in _edges(lines) if _line_key(line) in repeated}
+        compacted.append(
+            "\n".join(line for index, line in enumerate(lines) if index not in furniture)
+        )
+    tokens = {
+        "tokens_before": sum(estimate_tokens(text) for text in page_texts),
+        "tokens_after": sum(estimate_tokens(text) for text in compacted),
+    }
+    return compacted, tokens
@@ -3,13 +3,141 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# Created when the first workspace or artifact is written
 TEMP_DIR = "./tmp/"
-os.makedirs(
-    TEMP_DIR, exist_ok=True
-)  # Create the temporary directory if it doesn't exist
+
+# Uploads are streamed into a workspace of their own under TEMP_DIR, removed
+# when the job ends. Anything older than WORKSPACE_MAX_AGE seconds is swept.
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(200 * 1024 * 1024)))
+WORKSPACE_MAX_AGE = float(os.getenv("WORKSPACE_MAX_AGE", str(6 * 60 * 60)))
+WORKSPACE_SWEEP_INTERVAL = float(os.getenv("WORKSPACE_SWEEP_INTERVAL", "600"))
 
 REPLICATE_API_TOKEN = os.getenv("REPLICATE_API_TOKEN")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Any OpenAI-compatible API, e.g. the fake one in benchmarks/fake_openai.py
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
+
+# DocTR picks its backend when first imported, make it torch whatever imports it
+os.environ["USE_TORCH"] = "1"
+
+# DocTR models, loaded once per process and shared across requests
+OCR_DET_ARCH = os.getenv("OCR_DET_ARCH", "db_resnet50")
+OCR_RECO_ARCH = os.getenv("OCR_RECO_ARCH", "parseq")
+OCR_PREDICTOR_POOL_SIZE = int(os.getenv("OCR_PREDICTOR_POOL_SIZE", "1"))
+# Pages rasterized and recognized together, bounds peak memory per document
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "8"))
+# DE_GAN enhancement before OCR: "off", "adaptive" (pages read with a
+# confidence below ENHANCE_MIN_CONFIDENCE are enhanced and read again,
+# the better reading is kept) or "all" (every page is enhanced first)
+ENHANCE_MODE = os.getenv("ENHANCE_MODE", "off").lower()
+if ENHANCE_MODE not in ("off", "adaptive", "all"):
+    raise ValueError(
+        f"Wrong ENHANCE_MODE {ENHANCE_MODE}, please specify one of off, adaptive, all"
+    )
+ENHANCE_TASK = os.getenv("ENHANCE_TASK", "deblur")
+ENHANCE_MIN_CONFIDENCE = float(os.getenv("ENHANCE_MIN_CONFIDENCE", "0.8"))
+# Pages with fewer words (blank pages, diagrams) are never enhanced in
+# "adaptive" mode, there is no text DE_GAN could help to read
+ENHANCE_MIN_WORDS = int(os.getenv("ENHANCE_MIN_WORDS", "5"))
+
+# OCR runs in a pool of worker processes, each holding its own warm predictors
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "2"))
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", str(OCR_WORKERS)))
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "16"))
+# OCR batches each document has submitted to the pool at once, so the
+# batches of concurrent jobs take turns on the workers
+OCR_BATCHES_IN_FLIGHT = int(os.getenv("OCR_BATCHES_IN_FLIGHT", str(OCR_WORKERS)))
+# Finished jobs kept around so their results can still be polled
+JOB_HISTORY_SIZE = int(os.getenv("JOB_HISTORY_SIZE", "1000"))
+
+# "all" serves the API and runs OCR in its own worker pool. "api" serves the
+# API without loading any OCR model, sending PDFs to the OCR worker at
+# OCR_WORKER_URL. "worker" only serves OCR to API processes.
+SERVER_ROLE = os.getenv("SERVER_ROLE", "all").lower()
+if SERVER_ROLE not in ("all", "api", "worker"):
+    raise ValueError(
+        f"Wrong SERVER_ROLE {SERVER_ROLE}, please specify one of all, api, worker"
+    )
+OCR_WORKER_URL = os.getenv("OCR_WORKER_URL")
+if SERVER_ROLE == "api" and not OCR_WORKER_URL:
+    raise ValueError("SERVER_ROLE api needs OCR_WORKER_URL, the OCR worker to send PDFs to")
+
+# On-disk cache of OCR text and extraction results for repeat uploads
+CACHE_DIR = os.getenv("CACHE_DIR", "./cache/")
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# OCR results of single pages, found again by a perceptual hash of the page image:
+# its grayscale downsampled to PAGE_HASH_SIZE squared cells. Two pages match
+# when no cell differs by more than PAGE_HASH_TOLERANCE gray levels.
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+PAGE_HASH_SIZE = int(os.getenv("PAGE_HASH_SIZE", "64"))
+PAGE_HASH_TOLERANCE = int(os.getenv("PAGE_HASH_TOLERANCE", "8"))
+# A hash match is only reused once the page, downsampled to PAGE_SIGNATURE_WIDTH
+# pixels wide, differs nowhere by more than PAGE_SIGNATURE_TOLERANCE gray levels
+# from the stored one: the coarse hash cannot see a changed character.
+PAGE_SIGNATURE_WIDTH = int(os.getenv("PAGE_SIGNATURE_WIDTH", "400"))
+PAGE_SIGNATURE_TOLERANCE = int(os.getenv("PAGE_SIGNATURE_TOLERANCE", "24"))
+
+# Long documents are extracted in chunks of whole pages, several at once
+CHUNK_TOKEN_BUDGET = int(os.getenv("CHUNK_TOKEN_BUDGET", "6000"))
+CHUNK_CONCURRENCY = int(os.getenv("CHUNK_CONCURRENCY", "4"))
+# Pages are compacted, scored for relevance and extracted a window of this
+# many pages at a time, while the pages after it are still being read
+STREAM_WINDOW_PAGES = int(os.getenv("STREAM_WINDOW_PAGES", "32"))
+# LLM calls in flight at once across all documents of the process
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+# Identical extraction prompts (same text up to whitespace, instructions and
+# model) reuse the stored response for LLM_CACHE_TTL seconds. The backend is
+# "memory" (per process), "sqlite" (shared by processes, under CACHE_DIR) or
+# "off"; concurrent identical calls share one request to the model either way.
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory").lower()
+if LLM_CACHE_BACKEND not in ("memory", "sqlite", "off"):
+    raise ValueError(
+        f"Wrong LLM_CACHE_BACKEND {LLM_CACHE_BACKEND}, please specify one of memory, sqlite, off"
+    )
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(24 * 60 * 60)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+# Requests and tokens per minute allowed for each model, as "model=requests:tokens"
+# pairs separated by commas, e.g. "gpt-4-turbo=500:30000". Calls wait for
+# capacity instead of hitting 429s, models not listed are not limited.
+LLM_RATE_LIMITS = os.getenv("LLM_RATE_LIMITS", "")
+# Rate limited and failed calls are retried with jittered exponential backoff
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "6"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "1"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "60"))
+# Calls that would wait more than FALLBACK_AFTER seconds for their model's
+# rate limit go to FALLBACK_MODEL instead (e.g. gpt-3.5-turbo), if set
+FALLBACK_MODEL = os.getenv("FALLBACK_MODEL") or None
+FALLBACK_AFTER = float(os.getenv("FALLBACK_AFTER", "10"))
+# Keep-alive connections to the API, shared by every model
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+
+# Only pages scoring at least RELEVANCE_THRESHOLD times the best page on a
+# local troubleshooting index (and RELEVANCE_NEIGHBOURS pages around them)
+# are sent to the LLM. Lower the threshold for recall, 0 sends every page.
+RELEVANCE_THRESHOLD = float(os.getenv("RELEVANCE_THRESHOLD", "0.3"))
+RELEVANCE_NEIGHBOURS = int(os.getenv("RELEVANCE_NEIGHBOURS", "1"))
+
+# Pages whose existing text layer scores at least TEXT_LAYER_MIN_QUALITY are
+# read directly, only the others go through OCR. Set it above 1 to OCR every page.
+TEXT_LAYER_MIN_QUALITY = float(os.getenv("TEXT_LAYER_MIN_QUALITY", "0.75"))
+TEXT_LAYER_MIN_CHARS = int(os.getenv("TEXT_LAYER_MIN_CHARS", "50"))
+
+# Page texts are compacted before prompting: lines repeated at the top or
+# bottom of at least COMPACT_MIN_PAGE_FRACTION of the pages (running headers,
+# footers, page numbers) are dropped, whitespace and hyphenated line breaks
+# are collapsed. OCR'd words read with a confidence under OCR_JUNK_CONFIDENCE
+# that are mostly symbols are left out of the page text.
+COMPACT_TEXT = os.getenv("COMPACT_TEXT", "true").lower() in ("1", "true", "yes")
+COMPACT_MIN_PAGE_FRACTION = float(os.getenv("COMPACT_MIN_PAGE_FRACTION", "0.5"))
+OCR_JUNK_CONFIDENCE = float(os.getenv("OCR_JUNK_CONFIDENCE", "0.5"))
+
+# Rendering the searchable PDF is only needed when it is kept as an artifact
+EXPORT_SEARCHABLE_PDF = os.getenv("EXPORT_SEARCHABLE_PDF", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
 
 PROMPT_PREFIX = (
     "You are a top-tier algorithm for extracting information from text obtained from OCR run on older PDFs. "
@@ -1,27 +1,50 @@
 # Imports
 import base64
 import re
-from tempfile import TemporaryDirectory
+import threading
+from contextlib import contextmanager
+from queue import Queue
 from math import atan, cos, sin
-from typing import Dict, Optional, Tuple
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Sequence, Tuple
 from xml.etree import ElementTree as ET
 from xml.etree.ElementTree import Element
 
 import numpy as np
+import pypdfium2 as pdfium
 import PyPDF2
-from PyPDF2 import PdfFileMerger
-from doctr.io import DocumentFile
-from doctr.models import ocr_predictor
 from PIL import Image
+from reportlab import rl_config
 from reportlab.lib.colors import black
 from reportlab.lib.units import inch
 from reportlab.lib.utils import ImageReader
 from reportlab.pdfgen.canvas import Canvas
-from doctr.io import DocumentFile
-from doctr.models import ocr_predictor
 import os
 
-os.environ["USE_TORCH"] = "1"
+# DocTR loads torch, only processes that run OCR import it, in `load_models`
+if TYPE_CHECKING:
+    from doctr.io import Page
+
+from server.metrics import PAGES, stage
+from server.page_store import page_hash, page_store
+from server.pdf_writer import PartedPdfWriter
+from server.triage import usable_text_layers
+from server.constants import (
+    COMPACT_TEXT,
+    ENHANCE_MIN_CONFIDENCE,
+    ENHANCE_MIN_WORDS,
+    ENHANCE_MODE,
+    ENHANCE_TASK,
+    OCR_BATCH_SIZE,
+    OCR_DET_ARCH,
+    OCR_JUNK_CONFIDENCE,
+    OCR_PREDICTOR_POOL_SIZE,
+    OCR_RECO_ARCH,
+)
+
+# Process-wide pool of loaded predictors, filled once by `load_models`
+_PREDICTORS: Queue = Queue()
+_MODELS_LOADED = threading.Event()
+_LOAD_LOCK = threading.Lock()
 
 
 class HocrParser:
@@ -189,38 +212,434 @@ class HocrParser:
         pdf.save()
 
 
-def perform_ocr(pdf_path, output_pdf_path):
+_A85_LOCK = threading.Lock()
+
+
+@contextmanager
+def _binary_streams():
     """
-    Perform OCR on a PDF file using DocTR.
-    Can be time consuming but accurate.
+    Store images as binary streams rather than ASCII85 text, whose pure
+    Python encoder takes most of the time spent writing a page.
+    """
+    with _A85_LOCK:
+        use_a85 = rl_config.useA85
+        rl_config.useA85 = 0
+        try:
+            yield
+        finally:
+            rl_config.useA85 = use_a85
+
+
+# Ligatures the standard PDF fonts cannot show
+LIGATURES = str.maketrans({"ﬀ": "ff", "ﬃ": "f‌f‌i", "ﬄ": "f‌f‌l", "ﬁ": "fi", "ﬂ": "fl"})
+
+
+class SearchablePdfWriter(PartedPdfWriter):
+    """
+    Write DocTR pages as one searchable PDF, each page image under an
+    invisible text layer, in a single pass.
+    Reads word and line geometry straight from the DocTR pages, and places
+    the text exactly as `HocrParser.export_pdfa` does from their hOCR export.
+    Saved in parts of `pages_per_part` pages, see `PartedPdfWriter`.
+    """
+
+    def __init__(
+        self,
+        output_pdf_path: str,
+        fontname: str = "Times-Roman",
+        fontsize: int = 12,
+        invisible_text: bool = True,
+        add_spaces: bool = True,
+        dpi: int = 300,
+        pages_per_part: int = 32,
+    ):
+        super().__init__(output_pdf_path, pages_per_part)
+        self.fontname = fontname
+        self.fontsize = fontsize
+        self.invisible_text = invisible_text
+        self.add_spaces = add_spaces
+        self.dpi = dpi
+
+    def _pt_box(self, geometry, width: int, height: int) -> Tuple[float, ...]:
+        """
+        A relative DocTR box in PDF units, through the rounded pixel
+        coordinates of the hOCR export.
+        """
+        xmin, ymin, xmax, ymax = _box(geometry)
+        return tuple(
+            int(round(value * size)) / self.dpi * inch
+            for value, size in ((xmin, width), (ymin, height), (xmax, width), (ymax, height))
+        )
+
+    def add_page(self, page: "Page", image: Optional[np.ndarray] = None):
+        pdf = self._page_canvas()
+        height_px, width_px = page.dimensions
+        width, height = width_px / self.dpi * inch, height_px / self.dpi * inch
+        pdf.setPageSize((width, height))
+
+        for block in page.blocks:
+            for line in block.lines:
+                line_x1, _, _, line_y2 = self._pt_box(line.geometry, width_px, height_px)
+                # DocTR lines are straight, with their baseline on the bottom edge
+                baseline = height - line_y2
+
+                text = pdf.beginText()
+                text.setFont(self.fontname, self.fontsize)
+                pdf.setFillColor(black)
+                if self.invisible_text:
+                    text.setTextRenderMode(3)  # invisible text
+                text.setTextTransform(1, 0, 0, 1, line_x1, baseline)
+
+                for word in line.words:
+                    word_text = word.value.strip().translate(LIGATURES)
+                    if not word_text:
+                        continue
+                    x1, _, x2, _ = self._pt_box(word.geometry, width_px, height_px)
+                    if self.add_spaces:
+                        word_text += " "
+                    font_width = pdf.stringWidth(word_text, self.fontname, self.fontsize)
+                    box_width = x2 - x1 + (font_width if self.add_spaces else 0)
+
+                    cursor = text.getStartOfLine()
+                    text.moveCursor(x1 - cursor[0], baseline - cursor[1])
+                    # suppress text if it is 0 units wide
+                    if font_width > 0:
+                        text.setHorizScale(100 * box_width / font_width)
+                        text.textOut(word_text)
+                pdf.drawText(text)
+
+        if image is not None:
+            with _binary_streams():
+                pdf.drawImage(
+                    ImageReader(Image.fromarray(image)), 0, 0, width=width, height=height
+                )
+        self._end_page()
+
+
+def load_models(pool_size: int = OCR_PREDICTOR_POOL_SIZE):
+    """
+    Build the DocTR predictors and load their weights.
+    Runs once per process, later calls return immediately.
+    """
+    with _LOAD_LOCK:
+        if _MODELS_LOADED.is_set():
+            return
+        from doctr.models import ocr_predictor
+
+        for _ in range(max(pool_size, 1)):
+            _PREDICTORS.put(ocr_predictor(OCR_DET_ARCH, OCR_RECO_ARCH, pretrained=True))
+        if ENHANCE_MODE != "off":
+            from server.DE_GAN.enhance import init_worker
+
+            init_worker((ENHANCE_TASK,))
+        _MODELS_LOADED.set()
+
+
+def models_ready() -> bool:
+    """
+    Whether the DocTR predictors have been loaded in this process.
+    """
+    return _MODELS_LOADED.is_set()
+
+
+@contextmanager
+def get_predictor():
+    """
+    Borrow a warm predictor from the pool, blocking until one is free.
+    """
+    load_models()
+    predictor = _PREDICTORS.get()
+    try:
+        yield predictor
+    finally:
+        _PREDICTORS.put(predictor)
+
+
+def _box(geometry) -> Tuple[float, float, float, float]:
+    """
+    Returns (xmin, ymin, xmax, ymax) for straight or rotated DocTR geometries.
+    """
+    points = np.asarray(geometry, dtype=float).reshape(-1, 2)
+    xmin, ymin = points.min(axis=0)
+    xmax, ymax = points.max(axis=0)
+    return xmin, ymin, xmax, ymax
+
+
+def _reading_order(lines: List) -> List:
+    """
+    Sort lines top to bottom, keeping lines that share a row left to right.
+    """
+    rows = []
+    for line in sorted(lines, key=lambda line: _box(line.geometry)[1]):
+        xmin, ymin, _, ymax = _box(line.geometry)
+        # a line starting above the middle of the current row belongs to it
+        if rows and ymin < rows[-1]["middle"]:
+            rows[-1]["lines"].append((xmin, line))
+        else:
+            rows.append({"middle": (ymin + ymax) / 2, "lines": [(xmin, line)]})
+    return [
+        line
+        for row in rows
+        for _, line in sorted(row["lines"], key=lambda item: item[0])
+    ]
+
+
+def _is_junk(word, min_confidence: float) -> bool:
+    """
+    A word read with low confidence that is a single character or mostly
+    symbols, which is what specks, rules and smudges are read as.
+    """
+    if word.confidence >= min_confidence:
+        return False
+    value = word.value.strip()
+    return len(value) <= 1 or 2 * sum(char.isalnum() for char in value) < len(value)
+
+
+def page_text(
+    page, min_confidence: Optional[float] = OCR_JUNK_CONFIDENCE if COMPACT_TEXT else None
+) -> str:
     """
-    model = ocr_predictor("db_resnet50", "parseq", pretrained=True)
-    doc = DocumentFile.from_pdf(
-        pdf_path,
+    Build the text of a DocTR page directly from its words, in reading order,
+    leaving out junk words read with less than `min_confidence` (part of
+    COMPACT_TEXT, every word is kept when it is None).
+    """
+    lines = [line for block in page.blocks for line in block.lines]
+    texts = (
+        " ".join(
+            word.value
+            for word in line.words
+            if min_confidence is None or not _is_junk(word, min_confidence)
+        )
+        for line in _reading_order(lines)
     )
-    result = model(doc)
-    xml_outputs = result.export_as_xml()
-    parser = HocrParser()
+    return "\n".join(text for text in texts if text)
+
+
+def _page_words(page) -> list:
+    return [word for block in page.blocks for line in block.lines for word in line.words]
+
+
+def page_confidence(page) -> float:
+    """
+    Score how well a DocTR page was read, between 0 and 1: the mean of its
+    word confidences weighted by word length, with words far off the page's
+    typical text height (specks, smudges, merged lines) at half weight.
+    A page where no word was found scores 0.
+    """
+    words = _page_words(page)
+    if not words:
+        return 0.0
+    boxes = np.array([_box(word.geometry) for word in words])
+    heights = boxes[:, 3] - boxes[:, 1]
+    typical = np.median(heights)
+    weights = np.where((heights > typical / 2) & (heights < typical * 2), 1.0, 0.5)
+    lengths = np.array([max(len(word.value), 1) for word in words], dtype=float)
+    confidences = np.array([word.confidence for word in words], dtype=float)
+    weights = weights * lengths
+    return float((confidences * weights).sum() / weights.sum())
 
-    merger = PdfFileMerger()
-    for i, (xml, img) in enumerate(zip(xml_outputs, doc)):
-        xml_element_tree = xml[1]
-        with TemporaryDirectory() as tmpdir:
-            parser.export_pdfa(f"{tmpdir}/{i}.pdf", hocr=xml_element_tree, image=img)
-            merger.append(f"{tmpdir}/{i}.pdf")
-    merger.write(f"{output_pdf_path}")
+
+def enhance_page_images(
+    images: List[np.ndarray], task: str = ENHANCE_TASK
+) -> List[np.ndarray]:
+    """
+    Run rendered pages through DE_GAN, returned as RGB arrays for DocTR.
+    """
+    # TensorFlow is only loaded in processes that enhance
+    from server.DE_GAN.enhance import enhance_images
+
+    grays = [
+        np.asarray(Image.fromarray(image).convert("L"), dtype=np.float32) / 255.0
+        for image in images
+    ]
+    enhanced = []
+    for page in enhance_images(task, grays):
+        gray = np.rint(np.clip(page, 0, 1) * 255).astype(np.uint8)
+        enhanced.append(np.repeat(gray[..., None], 3, axis=2))
+    return enhanced
+
+
+def recognize(
+    images: List[np.ndarray],
+    mode: str = ENHANCE_MODE,
+    min_confidence: float = ENHANCE_MIN_CONFIDENCE,
+    min_words: int = ENHANCE_MIN_WORDS,
+) -> List["Page"]:
+    """
+    OCR page images, enhancing them with DE_GAN according to `mode`.
+    In "adaptive" mode only pages of at least `min_words` words scoring
+    below `min_confidence` are enhanced and read again, and the better
+    scoring reading is kept.
+    """
+    if mode == "all":
+        with stage("enhance"):
+            images = enhance_page_images(images)
+    with get_predictor() as model, stage("recognize"):
+        pages = list(model(images).pages)
+    if mode != "adaptive":
+        return pages
+
+    scores = [page_confidence(page) for page in pages]
+    retry = [
+        i
+        for i, (page, score) in enumerate(zip(pages, scores))
+        if score < min_confidence and len(_page_words(page)) >= min_words
+    ]
+    if retry:
+        with stage("enhance"):
+            enhanced = enhance_page_images([images[i] for i in retry])
+        with get_predictor() as model, stage("recognize"):
+            second = model(enhanced).pages
+        for i, page in zip(retry, second):
+            if page_confidence(page) > scores[i]:
+                pages[i] = page
+    return pages
+
+
+def iter_pdf_pages(
+    pdf_path: str,
+    batch_size: int = OCR_BATCH_SIZE,
+    pages: Optional[Sequence[int]] = None,
+    scale: float = 2,
+) -> Iterator[List[Tuple[int, np.ndarray]]]:
+    """
+    Rasterize a PDF a batch of pages at a time, as `DocumentFile.from_pdf` would.
+    Only `batch_size` page images are held in memory at once.
+    """
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        indices = range(len(pdf)) if pages is None else pages
+        batch = []
+        for index in indices:
+            page = pdf[index]
+            batch.append((index, page.render(scale=scale, rev_byteorder=True).to_numpy()))
+            page.close()
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        pdf.close()
+
+
+def iter_ocr(
+    pdf_path: str,
+    batch_size: int = OCR_BATCH_SIZE,
+    pages: Optional[Sequence[int]] = None,
+) -> Iterator[Tuple[int, np.ndarray, "Page"]]:
+    """
+    Run OCR batch by batch, yielding (page index, page image, DocTR page)
+    as soon as each batch is recognized.
+    Pages already seen, in this document or another one, are reused and
+    only new or changed pages go through the detector and recognizer.
+    """
+    batches = iter_pdf_pages(pdf_path, batch_size, pages)
+    while True:
+        with stage("rasterize"):
+            batch = next(batches, None)
+        if batch is None:
+            break
+        hashes = [page_hash(image) for _, image in batch]
+        results = [
+            page_store.find(image_hash, index, image)
+            for image_hash, (index, image) in zip(hashes, batch)
+        ]
+        missing = [i for i, page in enumerate(results) if page is None]
+        PAGES.inc(len(batch) - len(missing), source="reused")
+        PAGES.inc(len(missing), source="ocr")
+        if missing:
+            recognized = recognize([batch[i][1] for i in missing])
+            for i, page in zip(missing, recognized):
+                page.page_idx = batch[i][0]
+                results[i] = page
+                page_store.add(hashes[i], page, batch[i][1])
+        for (index, image), page in zip(batch, results):
+            yield index, image, page
+
+
+def count_pages(pdf_path: str) -> int:
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def ocr_pages(pdf_path: str, pages: Sequence[int]) -> List[str]:
+    """
+    OCR a subset of the pages and return their texts, so a document can be
+    spread over several workers and reported on page range by page range.
+    """
+    return [page_text(page) for _, _, page in iter_ocr(pdf_path, pages=pages)]
+
+
+def read_page_texts(pdf_path: str, pages: Sequence[int]) -> List[str]:
+    """
+    The texts of a subset of the pages: their text layer where it is usable,
+    OCR for the others. Triage goes batch by batch with OCR, so the first
+    pages of a long document are read without waiting on the rest.
+    """
+    layers = usable_text_layers(pdf_path, pages=pages)
+    needs_ocr = [index for index, layer in zip(pages, layers) if layer is None]
+    PAGES.inc(len(pages) - len(needs_ocr), source="text_layer")
+    ocr_texts = dict(zip(needs_ocr, ocr_pages(pdf_path, needs_ocr))) if needs_ocr else {}
+    return [
+        ocr_texts[index] if layer is None else layer for index, layer in zip(pages, layers)
+    ]
+
+
+def perform_ocr(
+    pdf_path,
+    output_pdf_path: Optional[str] = None,
+    batch_size: int = OCR_BATCH_SIZE,
+) -> List[str]:
+    """
+    Perform OCR on a PDF file using DocTR.
+    Can be time consuming but accurate.
+    Returns the text of each page; the searchable PDF is only rendered
+    when `output_pdf_path` is given. Pages with a usable text layer are
+    not OCR'd: their text is taken and the page copied over as it is.
+    """
+    layers = usable_text_layers(pdf_path)
+    needs_ocr = [index for index, layer in enumerate(layers) if layer is None]
+    PAGES.inc(len(layers) - len(needs_ocr), source="text_layer")
+    recognized = iter_ocr(pdf_path, batch_size, pages=needs_ocr)
+    page_texts = []
+    writer = SearchablePdfWriter(output_pdf_path) if output_pdf_path is not None else None
+    try:
+        for index, layer in enumerate(layers):
+            if layer is not None:
+                page_texts.append(layer)
+                if writer is not None:
+                    writer.copy_page(pdf_path, index)
+                continue
+            _, image, page = next(recognized)
+            page_texts.append(page_text(page))
+            if writer is not None:
+                with stage("export_pdfa"):
+                    writer.add_page(page, image)
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+    if writer is not None:
+        with stage("export_pdfa"):
+            writer.close()
+    return page_texts
 
 
 def extract_text(pdf_path):
     """
     Use PyPDF2 to extract text from a PDF that has undergone OCR correction.
     """
-    reader = PyPDF2.PdfFileReader(pdf_path)
-    num_pages = reader.getNumPages()
-    pages = {}
-    texts = []
-    for page_number in range(0, num_pages):
-        page = reader.getPage(page_number)
-        pages[page_number] = f"\nPage {page_number + 1}\n" + page.extractText()
-        texts.append(pages[page_number])
-    return "\n".join(texts)
+    with stage("extract_text"):
+        reader = PyPDF2.PdfFileReader(pdf_path)
+        num_pages = reader.getNumPages()
+        pages = {}
+        texts = []
+        for page_number in range(0, num_pages):
+            page = reader.getPage(page_number)
+            pages[page_number] = f"\nPage {page_number + 1}\n" + page.extractText()
+            texts.append(pages[page_number])
+        return "\n".join(texts)
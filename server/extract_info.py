@@ -1,19 +1,62 @@
-from typing import Any, Dict, Optional, List
-from uuid import uuid4
+from collections import deque
+from concurrent.futures import Executor
+from typing import Any, AsyncIterator, Dict, Optional, List, Tuple
+import asyncio
+import json
 import os
+import time
 
 
+import httpx
 from fastapi import HTTPException
 from jsonschema import Draft202012Validator, exceptions
+from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.output_parsers import JsonOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import chain
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
 from langserve import CustomUserType
 from pydantic import BaseModel, Field, validator
 
-from server.models import get_model, DEFAULT_MODEL
-from server.doctr_utils import perform_ocr, extract_text
-from server.constants import PROMPT_PREFIX, TEMP_DIR
+from server.models import AnsweringModels, get_model, DEFAULT_MODEL
+from server.doctr_utils import count_pages, perform_ocr, read_page_texts
+from server.cache import cache_key, file_sha256, ocr_cache, result_cache
+from server.chunking import chunk_pages, merge_extractions
+from server.compaction import compact_pages
+from server.llm_cache import Uncached, llm_cache, llm_cache_key
+from server.constants import (
+    CHUNK_CONCURRENCY,
+    CHUNK_TOKEN_BUDGET,
+    COMPACT_MIN_PAGE_FRACTION,
+    COMPACT_TEXT,
+    ENHANCE_MIN_CONFIDENCE,
+    ENHANCE_MIN_WORDS,
+    ENHANCE_MODE,
+    ENHANCE_TASK,
+    EXPORT_SEARCHABLE_PDF,
+    LLM_CONCURRENCY,
+    OCR_BATCH_SIZE,
+    OCR_BATCHES_IN_FLIGHT,
+    TEXT_LAYER_MIN_QUALITY,
+    OCR_DET_ARCH,
+    OCR_JUNK_CONFIDENCE,
+    OCR_RECO_ARCH,
+    OCR_WORKER_URL,
+    PROMPT_PREFIX,
+    RELEVANCE_NEIGHBOURS,
+    RELEVANCE_THRESHOLD,
+    SERVER_ROLE,
+    STREAM_WINDOW_PAGES,
+)
+from server.metrics import (
+    COMPACTION_TOKENS,
+    STAGE_SECONDS,
+    collect,
+    replay,
+    stage,
+    token_usage,
+)
+from server.relevance import RelevanceFilter
+from server.text_utils import format_pages
 
 
 class ExtractResponse(BaseModel):
@@ -57,35 +100,506 @@ def _make_prompt_template(
     return ChatPromptTemplate.from_messages(prompt_components)
 
 
-@chain
-async def extraction_runnable(extraction_request: ExtractRequest) -> ExtractResponse:
-    """An end point to extract content from a given text object."""
-
+def _extraction_chain(
+    extraction_request: ExtractRequest, model: Optional[BaseChatModel] = None
+) -> Runnable:
+    """The prompt, chat model and JSON parser, on `model` if given instead of the named one."""
     prompt = _make_prompt_template(
         extraction_request.instructions,
     )
-    model = get_model(extraction_request.model_name)
+    if model is None:
+        model = get_model(extraction_request.model_name)
     parser = JsonOutputParser()
-    runnable = (prompt | model).with_config({"run_name": "extraction"}) | parser
+    return (prompt | model).with_config(
+        {"run_name": "extraction", "callbacks": [token_usage]}
+    ) | parser
 
-    return await runnable.ainvoke({"text": extraction_request.text})
 
+# Shared by every extraction in the process, see `limit_llm_calls`
+_llm_semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
 
-async def extract_from_pdf(
+
+def limit_llm_calls(max_concurrency: int):
+    """Change how many LLM calls may be in flight at once across all documents."""
+    global _llm_semaphore
+    _llm_semaphore = asyncio.Semaphore(max_concurrency)
+
+
+def _llm_cache_key(extraction_request: ExtractRequest) -> str:
+    return llm_cache_key(
+        extraction_request.text,
+        extraction_request.instructions,
+        extraction_request.model_name or DEFAULT_MODEL,
+    )
+
+
+async def _extract(
+    extraction_request: ExtractRequest,
+    model: Optional[BaseChatModel] = None,
+    fell_back: Optional[List[ExtractRequest]] = None,
+) -> Any:
+    """
+    Run the extraction prompt on the request's text, or reuse the response
+    to an identical prompt. Calls to an injected `model` are not cached,
+    nor answers from the fallback model, whose requests go to `fell_back`.
+    """
+    runnable = _extraction_chain(extraction_request, model)
+    model_name = extraction_request.model_name or DEFAULT_MODEL
+
+    async def call():
+        answered = AnsweringModels()
+        async with _llm_semaphore:
+            output = await runnable.with_config({"callbacks": [answered]}).ainvoke(
+                {"text": extraction_request.text}
+            )
+        return Uncached(output) if answered.fell_back(model_name) else output
+
+    if model is not None:
+        return await call()
+    output = await llm_cache.get_or_call(_llm_cache_key(extraction_request), call)
+    if isinstance(output, Uncached):
+        if fell_back is not None:
+            fell_back.append(extraction_request)
+        return output.value
+    return output
+
+
+class CachedExtraction(Runnable[ExtractRequest, Any]):
+    """
+    An end point to extract content from a given text object, with responses
+    cached and concurrent duplicates coalesced, see `server.llm_cache`.
+    A streamed cache miss still yields partial JSON as it is parsed.
+    Answers from the fallback model are returned but not cached.
+    """
+
+    def _chain(self, extraction_request: ExtractRequest, answered: AnsweringModels) -> Runnable:
+        return (
+            RunnableLambda(lambda request: {"text": request.text})
+            | _extraction_chain(extraction_request)
+        ).with_config({"callbacks": [answered]})
+
+    def invoke(
+        self, input: ExtractRequest, config: Optional[RunnableConfig] = None, **kwargs
+    ) -> Any:
+        key = _llm_cache_key(input)
+        output = llm_cache.get(key)
+        if output is None:
+            answered = AnsweringModels()
+            output = self._chain(input, answered).invoke(input, config)
+            if not answered.fell_back(input.model_name or DEFAULT_MODEL):
+                llm_cache.put(key, output)
+        return output
+
+    async def ainvoke(
+        self, input: ExtractRequest, config: Optional[RunnableConfig] = None, **kwargs
+    ) -> Any:
+        answered = AnsweringModels()
+        runnable = self._chain(input, answered)
+
+        async def call():
+            async with _llm_semaphore:
+                output = await runnable.ainvoke(input, config)
+            if answered.fell_back(input.model_name or DEFAULT_MODEL):
+                return Uncached(output)
+            return output
+
+        output = await llm_cache.get_or_call(_llm_cache_key(input), call)
+        return output.value if isinstance(output, Uncached) else output
+
+    async def astream(
+        self, input: ExtractRequest, config: Optional[RunnableConfig] = None, **kwargs
+    ) -> AsyncIterator[Any]:
+        key = _llm_cache_key(input)
+        output = llm_cache.get(key)
+        in_flight = llm_cache.in_flight(key)
+        if output is None and in_flight is not None:
+            output = await asyncio.shield(in_flight)
+            if isinstance(output, Uncached):
+                output = output.value
+        if output is not None:
+            yield output
+            return
+        answered = AnsweringModels()
+        async with _llm_semaphore:
+            async for output in self._chain(input, answered).astream(input, config):
+                yield output
+        # The parser yields everything parsed so far, the last output is complete
+        if not answered.fell_back(input.model_name or DEFAULT_MODEL):
+            llm_cache.put(key, output)
+
+
+extraction_runnable = CachedExtraction()
+
+
+async def iter_extract_chunked(
+    page_texts: List[str],
+    model_name: Optional[str] = None,
+    instructions: Optional[str] = None,
+    token_budget: int = CHUNK_TOKEN_BUDGET,
+    max_concurrency: int = CHUNK_CONCURRENCY,
+    model: Optional[BaseChatModel] = None,
+    page_numbers: Optional[List[int]] = None,
+    fell_back: Optional[List[ExtractRequest]] = None,
+) -> AsyncIterator[Tuple[List[int], Any]]:
+    """
+    Split the pages into chunks of at most `token_budget` tokens and run up to
+    `max_concurrency` of them at once, yielding (page numbers, output) for
+    each chunk as soon as it is done.
+    `model` replaces the named chat model, e.g. with a fake one for benchmarks.
+    Chunks the fallback model answered are added to `fell_back`.
+    """
+    chunks = chunk_pages(page_texts, token_budget, page_numbers)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(chunk):
+        chunk_page_numbers, texts = zip(*chunk)
+        request = ExtractRequest(
+            text=format_pages(texts, chunk_page_numbers),
+            instructions=instructions,
+            model_name=model_name,
+        )
+        async with semaphore:
+            return list(chunk_page_numbers), await _extract(
+                request, model=model, fell_back=fell_back
+            )
+
+    tasks = [asyncio.ensure_future(run(chunk)) for chunk in chunks]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def _merge_chunks(results: List[Tuple[List[int], Any]]) -> Any:
+    """Merge chunk outputs by page number, a single chunk is returned as is."""
+    if not results:
+        return []
+    if len(results) == 1:
+        return results[0][1]
+    return merge_extractions([output for _, output in sorted(results, key=lambda r: r[0])])
+
+
+async def extract_chunked(
+    page_texts: List[str],
+    model_name: Optional[str] = None,
+    instructions: Optional[str] = None,
+    token_budget: int = CHUNK_TOKEN_BUDGET,
+    max_concurrency: int = CHUNK_CONCURRENCY,
+    model: Optional[BaseChatModel] = None,
+    page_numbers: Optional[List[int]] = None,
+) -> Any:
+    """
+    Extract from long documents in concurrent chunks, see `iter_extract_chunked`,
+    and merge their results by page number.
+    """
+    results = [
+        result
+        async for result in iter_extract_chunked(
+            page_texts,
+            model_name=model_name,
+            instructions=instructions,
+            token_budget=token_budget,
+            max_concurrency=max_concurrency,
+            model=model,
+            page_numbers=page_numbers,
+        )
+    ]
+    return _merge_chunks(results)
+
+
+def ocr_config() -> Dict[str, Any]:
+    """The OCR settings that affect the page texts, part of the cache key."""
+    return {
+        "engine": f"doctr:{OCR_DET_ARCH}:{OCR_RECO_ARCH}",
+        "enhance": None
+        if ENHANCE_MODE == "off"
+        else {
+            "mode": ENHANCE_MODE,
+            "task": ENHANCE_TASK,
+            "min_confidence": ENHANCE_MIN_CONFIDENCE,
+            "min_words": ENHANCE_MIN_WORDS,
+        },
+        "text_layer_min_quality": TEXT_LAYER_MIN_QUALITY,
+        "junk_confidence": OCR_JUNK_CONFIDENCE if COMPACT_TEXT else None,
+    }
+
+
+def searchable_pdf_path(file: str) -> str:
+    """Where the searchable PDF of `file` is written with EXPORT_SEARCHABLE_PDF: beside it."""
+    return os.path.splitext(file)[0] + ".searchable.pdf"
+
+
+async def ocr_page_texts(
+    file: str,
+    executor: Optional[Executor],
+    timings: Dict[str, float],
+    export: bool = EXPORT_SEARCHABLE_PDF,
+) -> AsyncIterator[Tuple[List[int], List[str], int]]:
+    """
+    Read the PDF's pages in `executor` a batch at a time, yielding (page
+    indices, page texts, page count) in page order. Pages with a usable
+    text layer are taken as is, only the others are OCR'd, see
+    `read_page_texts`. Up to OCR_BATCHES_IN_FLIGHT batches are in the pool
+    at once, so several workers can share one document while concurrent
+    jobs still get their turn. With `export`, the searchable PDF is
+    written beside `file` as well.
+    Stage times measured in the workers are added to `timings`.
+    """
+    loop = asyncio.get_running_loop()
+    total = await loop.run_in_executor(None, count_pages, file)
+    if export:
+        # The searchable PDF is rendered in one pass over the whole document
+        page_texts, updates = await loop.run_in_executor(
+            executor, collect, perform_ocr, file, searchable_pdf_path(file)
+        )
+        replay(updates, timings)
+        yield list(range(total)), page_texts, total
+        return
+
+    batches = iter(
+        [
+            list(range(start, min(start + OCR_BATCH_SIZE, total)))
+            for start in range(0, total, OCR_BATCH_SIZE)
+        ]
+    )
+    # Batches are submitted as earlier ones finish, so a long document does
+    # not hold the pool while other jobs' first pages wait behind it
+    in_flight = deque()
+
+    def submit():
+        pages = next(batches, None)
+        if pages is not None:
+            future = loop.run_in_executor(executor, collect, read_page_texts, file, pages)
+            in_flight.append((pages, future))
+
+    for _ in range(max(1, OCR_BATCHES_IN_FLIGHT)):
+        submit()
+    try:
+        while in_flight:
+            pages, future = in_flight[0]
+            texts, updates = await future
+            in_flight.popleft()
+            submit()
+            replay(updates, timings)
+            yield pages, texts, total
+    finally:
+        for _, future in in_flight:
+            future.cancel()
+
+
+async def _remote_page_texts(
+    file: str, timings: Dict[str, float]
+) -> AsyncIterator[Tuple[List[int], List[str], int]]:
+    """
+    Read the PDF's pages on the OCR worker at OCR_WORKER_URL, yielding them
+    like `ocr_page_texts` as the worker streams them back.
+    Stage times measured on the worker are added to `timings`.
+    """
+    async with httpx.AsyncClient(base_url=OCR_WORKER_URL, timeout=None) as client:
+        with open(file, "rb") as f:
+            async with client.stream(
+                "POST", "/ocr", files={"file": ("input.pdf", f, "application/pdf")}
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if "error" in event:
+                        raise RuntimeError(f"OCR worker failed: {event['error']}")
+                    if "timings" in event:
+                        for name, seconds in event["timings"].items():
+                            timings[name] = timings.get(name, 0.0) + seconds
+                    else:
+                        yield event["pages"], event["texts"], event["total"]
+
+
+async def _worker_ocr_config() -> Dict[str, Any]:
+    """
+    The `ocr_config` of the OCR worker at OCR_WORKER_URL: it reads the pages,
+    so its settings key the OCR cache, not this process's.
+    """
+    async with httpx.AsyncClient(base_url=OCR_WORKER_URL) as client:
+        response = await client.get("/ocr/config")
+        response.raise_for_status()
+        return response.json()
+
+
+async def _interleave(*iterators: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    """
+    Yield the items of several async iterators as each produces them.
+    An error in any of them stops the others and is raised.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    finished = object()
+
+    async def drain(iterator):
+        try:
+            async for item in iterator:
+                await queue.put((item, None))
+            await queue.put((finished, None))
+        except Exception as e:
+            await queue.put((finished, e))
+
+    tasks = [asyncio.ensure_future(drain(iterator)) for iterator in iterators]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            item, error = await queue.get()
+            if error is not None:
+                raise error
+            if item is finished:
+                remaining -= 1
+            else:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def stream_extract_from_pdf(
     file: str,
     model_name: Optional[str],
-) -> ExtractResponse:
-    output_pdf = os.path.join(TEMP_DIR, str(uuid4()) + ".pdf")
-    # output_pdf = "temp_ocr.pdf"
-    perform_ocr(file, output_pdf)
+    executor: Optional[Executor] = None,
+    export: bool = EXPORT_SEARCHABLE_PDF,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Run OCR on the PDF and extract troubleshooting information from its text,
+    yielding progress events as they happen:
+
+    - `{"event": "ocr", "page": n, "pages": total}` once page n is read,
+    - `{"event": "compaction", "tokens_before": ..., "tokens_after": ...}`
+      once headers, footers and noise are stripped from a window of pages,
+    - `{"event": "extraction", "pages": [...], "data": ...}` for each chunk,
+    - `{"event": "done", "data": [...], "timings": {...}}` with the merged
+      result and the seconds spent in each stage, last.
+
+    Pages are compacted, scored for relevance and extracted a window of
+    STREAM_WINDOW_PAGES pages at a time, as soon as the window is read, so
+    the first `extraction` events arrive while later pages are still in OCR.
+
+    OCR runs in `executor` (a thread by default) so the event loop stays free,
+    or on the OCR worker when this process only serves the API.
+    OCR text and results are cached by the PDF's hash, a repeat upload
+    skips both (and so does not produce a searchable PDF). With `export`,
+    the searchable PDF is written beside `file`.
+    """
     if model_name is None:
         model_name = DEFAULT_MODEL
-
-    text = extract_text(output_pdf)
-    extract_response = await extraction_runnable.ainvoke(
-        ExtractRequest(text=text, model_name=model_name)
+    loop = asyncio.get_running_loop()
+    timings: Dict[str, float] = {}
+    start = time.perf_counter()
+    with stage("hash", timings):
+        pdf_hash = await loop.run_in_executor(None, file_sha256, file)
+    config = await _worker_ocr_config() if SERVER_ROLE == "api" else ocr_config()
+    ocr_key = cache_key(pdf_hash, config)
+    result_key = cache_key(
+        ocr_key,
+        model_name,
+        PROMPT_PREFIX,
+        CHUNK_TOKEN_BUDGET,
+        RELEVANCE_THRESHOLD,
+        RELEVANCE_NEIGHBOURS,
+        COMPACT_TEXT,
+        COMPACT_MIN_PAGE_FRACTION,
+        STREAM_WINDOW_PAGES,
     )
+
+    cached_response = result_cache.get(result_key)
+    if cached_response is not None:
+        timings["total"] = time.perf_counter() - start
+        STAGE_SECONDS.observe(timings["total"], stage="total")
+        yield {"event": "done", **cached_response, "timings": timings}
+        return
+
+    # Windows of pages ready to extract, as (index of the first page, page
+    # texts), then None once every page is read
+    windows: asyncio.Queue = asyncio.Queue()
+    results = []
+    # Chunks answered by the fallback model, the result is not cached then
+    fell_back: List[ExtractRequest] = []
+
+    async def read_pages() -> AsyncIterator[Dict[str, Any]]:
+        queued = 0
+        page_texts = ocr_cache.get(ocr_key)
+        if page_texts is not None:
+            yield {"event": "ocr", "page": len(page_texts), "pages": len(page_texts)}
+        else:
+            page_texts = []
+            with stage("ocr", timings):
+                if SERVER_ROLE == "api":
+                    read = _remote_page_texts(file, timings)
+                else:
+                    read = ocr_page_texts(file, executor, timings, export)
+                async for pages, texts, total in read:
+                    page_texts.extend(texts)
+                    for page in pages:
+                        yield {"event": "ocr", "page": page + 1, "pages": total}
+                    while len(page_texts) - queued >= STREAM_WINDOW_PAGES:
+                        await windows.put(
+                            (queued, page_texts[queued : queued + STREAM_WINDOW_PAGES])
+                        )
+                        queued += STREAM_WINDOW_PAGES
+            ocr_cache.put(ocr_key, page_texts)
+        for first in range(queued, len(page_texts), STREAM_WINDOW_PAGES):
+            await windows.put((first, page_texts[first : first + STREAM_WINDOW_PAGES]))
+        await windows.put(None)
+
+    async def extract_windows() -> AsyncIterator[Dict[str, Any]]:
+        # Pages are judged against the whole document read so far, not only their window
+        relevance = RelevanceFilter()
+        # One window at a time, so a document never has more than
+        # CHUNK_CONCURRENCY chunks in flight
+        while True:
+            window = await windows.get()
+            if window is None:
+                return
+            first, page_texts = window
+            if COMPACT_TEXT:
+                with stage("compact", timings):
+                    page_texts, tokens = compact_pages(page_texts)
+                COMPACTION_TOKENS.inc(tokens["tokens_before"], state="before")
+                COMPACTION_TOKENS.inc(tokens["tokens_after"], state="after")
+                yield {"event": "compaction", **tokens}
+
+            # Skip pages that are unlikely to hold troubleshooting information
+            with stage("relevance", timings):
+                relevant = relevance.select(page_texts)
+            with stage("llm", timings):
+                async for page_numbers, output in iter_extract_chunked(
+                    [page_texts[i] for i in relevant],
+                    model_name=model_name,
+                    page_numbers=[first + i + 1 for i in relevant],
+                    fell_back=fell_back,
+                ):
+                    results.append((page_numbers, output))
+                    yield {"event": "extraction", "pages": page_numbers, "data": output}
+
+    async for event in _interleave(read_pages(), extract_windows()):
+        yield event
+
+    extract_response = _merge_chunks(results)
     if isinstance(extract_response, dict):
         extract_response = [extract_response]
     response = ExtractResponse(data=extract_response)
-    return response
+    if not fell_back:
+        result_cache.put(result_key, response.dict())
+    timings["total"] = time.perf_counter() - start
+    STAGE_SECONDS.observe(timings["total"], stage="total")
+    yield {"event": "done", **response.dict(), "timings": timings}
+
+
+async def extract_from_pdf(
+    file: str,
+    model_name: Optional[str],
+    executor: Optional[Executor] = None,
+) -> ExtractResponse:
+    """
+    Run OCR on the PDF and extract troubleshooting information from its text.
+    See `stream_extract_from_pdf`.
+    """
+    async for event in stream_extract_from_pdf(file, model_name, executor):
+        if event["event"] == "done":
+            return ExtractResponse(data=event["data"])
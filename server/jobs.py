@@ -0,0 +1,302 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum
+from multiprocessing import get_context
+from typing import Any, AsyncIterator, Dict, Optional, Set
+from uuid import uuid4
+
+from pydantic import BaseModel
+
+from server.constants import (
+    JOB_HISTORY_SIZE,
+    MAX_CONCURRENT_JOBS,
+    MAX_QUEUED_JOBS,
+    OCR_WORKERS,
+    SERVER_ROLE,
+)
+from server.doctr_utils import load_models
+from server.extract_info import (
+    ExtractResponse,
+    ocr_page_texts,
+    searchable_pdf_path,
+    stream_extract_from_pdf,
+)
+from server.metrics import JOBS, JOBS_IN_FLIGHT, JOBS_QUEUED
+from server.workspace import Workspace
+
+logger = logging.getLogger(__name__)
+
+
+class JobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+
+class Job(BaseModel):
+    """Status and, once finished, the result of an extraction job."""
+
+    id: str
+    status: JobStatus = JobStatus.queued
+    pages_done: int = 0
+    pages_total: Optional[int] = None
+    result: Optional[ExtractResponse] = None
+    error: Optional[str] = None
+    # seconds spent in each stage, once done
+    timings: Dict[str, float] = {}
+    # where to download the searchable PDF, with EXPORT_SEARCHABLE_PDF
+    searchable_pdf: Optional[str] = None
+
+
+class QueueFullError(Exception):
+    """Raised when no more jobs can be accepted."""
+
+
+def init_worker(workers: int):
+    """
+    Split the cores between OCR workers and load the models once per worker.
+    """
+    import torch
+
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+    load_models()
+
+
+class JobManager:
+    """
+    Runs extraction jobs in the background.
+    OCR happens in a process pool, at most `max_concurrent` jobs run at once
+    and at most `max_queued` more wait for a slot.
+    """
+
+    def __init__(
+        self,
+        workers: int = OCR_WORKERS,
+        max_concurrent: int = MAX_CONCURRENT_JOBS,
+        max_queued: int = MAX_QUEUED_JOBS,
+        history_size: int = JOB_HISTORY_SIZE,
+    ):
+        self.workers = workers
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.history_size = history_size
+        self.ready = False
+        self._jobs: Dict[str, Job] = OrderedDict()
+        self._active = 0
+        self.running = 0
+        self._tasks = set()
+        # workspaces of streams holding a slot, see `release`
+        self._streams: Set[str] = set()
+        # workspaces kept for their searchable PDF, by job id
+        self._artifacts: Dict[str, Workspace] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def start(self):
+        # API-only processes send OCR to the OCR worker and load no models
+        if SERVER_ROLE != "api":
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=get_context("spawn"),
+                initializer=init_worker,
+                initargs=(self.workers,),
+            )
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+    async def warm_up(self):
+        """
+        Spawn every worker and wait until their models are loaded.
+        """
+        if self._executor is not None:
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(
+                *[
+                    loop.run_in_executor(self._executor, load_models)
+                    for _ in range(self.workers)
+                ]
+            )
+        self.ready = True
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def check_capacity(self):
+        if self._active >= self.max_concurrent + self.max_queued:
+            raise QueueFullError("Too many extraction jobs in progress.")
+
+    def submit(self, workspace: Workspace, model_name: Optional[str]) -> Job:
+        """
+        Queue the workspace's PDF for extraction.
+        The workspace is removed once the job ends, whether it succeeded or not,
+        unless it holds a searchable PDF, kept until the job is forgotten.
+        """
+        self.check_capacity()
+        job = Job(id=str(uuid4()))
+        self._jobs[job.id] = job
+        self._active += 1
+        task = asyncio.create_task(self._run(job, workspace, model_name))
+        # keep a reference so the task isn't garbage collected mid-run
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def stream(
+        self, workspace: Workspace, model_name: Optional[str]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Run an extraction while the caller consumes its progress events.
+        Counts against the same limits as queued jobs until the stream ends
+        or `release` is called, which also removes the workspace.
+        """
+        self.check_capacity()
+        self._active += 1
+        self._streams.add(workspace.path)
+        return self._stream(workspace, model_name)
+
+    async def _stream(
+        self, workspace: Workspace, model_name: Optional[str]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        try:
+            async with self._semaphore:
+                self.running += 1
+                try:
+                    async for event in stream_extract_from_pdf(
+                        file=workspace.input_pdf,
+                        model_name=model_name,
+                        executor=self._executor,
+                    ):
+                        yield event
+                finally:
+                    self.running -= 1
+            JOBS.inc(status="done")
+        except Exception as e:
+            logger.exception("Streaming extraction failed")
+            JOBS.inc(status="failed")
+            yield {"event": "error", "detail": str(e)}
+        finally:
+            self.release(workspace)
+
+    def read_pages(self, workspace: Workspace) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Read the workspace's PDF for an API process, see `ocr_page_texts`:
+        the page texts of each batch as they are read, then the stage timings
+        (or the error). Counts against the same limits as extraction jobs,
+        see `stream`.
+        """
+        self.check_capacity()
+        self._active += 1
+        self._streams.add(workspace.path)
+        return self._read_pages(workspace)
+
+    async def _read_pages(self, workspace: Workspace) -> AsyncIterator[Dict[str, Any]]:
+        timings: Dict[str, float] = {}
+        try:
+            async with self._semaphore:
+                self.running += 1
+                try:
+                    # the workspace is removed with the response, a searchable
+                    # PDF written into it would never reach the API process
+                    async for pages, texts, total in ocr_page_texts(
+                        workspace.input_pdf, self._executor, timings, export=False
+                    ):
+                        yield {"pages": pages, "texts": texts, "total": total}
+                finally:
+                    self.running -= 1
+            yield {"timings": timings}
+        except Exception as e:
+            logger.exception("Reading pages failed")
+            yield {"error": str(e)}
+        finally:
+            self.release(workspace)
+
+    def release(self, workspace: Workspace):
+        """
+        Free the slot and remove the workspace of a stream once its response
+        is over, also when it was never read (the client went away before
+        the first chunk). Releasing twice does nothing.
+        """
+        if workspace.path not in self._streams:
+            return
+        self._streams.discard(workspace.path)
+        self._active -= 1
+        workspace.cleanup()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def searchable_pdf(self, job_id: str) -> Optional[str]:
+        """Path of the searchable PDF a finished job wrote, if it is still kept."""
+        workspace = self._artifacts.get(job_id)
+        return None if workspace is None else searchable_pdf_path(workspace.input_pdf)
+
+    @property
+    def queue_depth(self) -> int:
+        """Jobs and streams waiting for a free slot."""
+        return self._active - self.running
+
+    async def _run(self, job: Job, workspace: Workspace, model_name: Optional[str]):
+        try:
+            async with self._semaphore:
+                job.status = JobStatus.running
+                self.running += 1
+                try:
+                    async for event in stream_extract_from_pdf(
+                        file=workspace.input_pdf,
+                        model_name=model_name,
+                        executor=self._executor,
+                    ):
+                        if event["event"] == "ocr":
+                            job.pages_done = event["page"]
+                            job.pages_total = event["pages"]
+                        elif event["event"] == "done":
+                            job.result = ExtractResponse(data=event["data"])
+                            job.timings = event["timings"]
+                finally:
+                    self.running -= 1
+                job.status = JobStatus.done
+            JOBS.inc(status="done")
+        except Exception as e:
+            logger.exception("Extraction job %s failed", job.id)
+            job.status = JobStatus.failed
+            job.error = str(e)
+            JOBS.inc(status="failed")
+        finally:
+            self._active -= 1
+            self._keep_artifacts(job, workspace)
+            self._prune()
+
+    def _keep_artifacts(self, job: Job, workspace: Workspace):
+        """
+        Keep the workspace of a job that wrote a searchable PDF, without the
+        uploaded PDF, and remove any other.
+        """
+        output_pdf = searchable_pdf_path(workspace.input_pdf)
+        if job.status != JobStatus.done or not os.path.exists(output_pdf):
+            workspace.cleanup()
+            return
+        os.remove(workspace.input_pdf)
+        self._artifacts[job.id] = workspace
+        job.searchable_pdf = f"/extract/{job.id}/searchable.pdf"
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond the history size."""
+        finished = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.status in (JobStatus.done, JobStatus.failed)
+        ]
+        for job_id in finished[: max(0, len(finished) - self.history_size)]:
+            del self._jobs[job_id]
+            workspace = self._artifacts.pop(job_id, None)
+            if workspace is not None:
+                workspace.cleanup()
+
+
+job_manager = JobManager()
+JOBS_QUEUED.set_function(lambda: job_manager.queue_depth)
+JOBS_IN_FLIGHT.set_function(lambda: job_manager.running)
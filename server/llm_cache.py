@@ -0,0 +1,224 @@
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+
+from server.cache import cache_key
+from server.constants import (
+    CACHE_DIR,
+    LLM_CACHE_BACKEND,
+    LLM_CACHE_MAX_ENTRIES,
+    LLM_CACHE_TTL,
+    PROMPT_PREFIX,
+)
+from server.metrics import CACHE_REQUESTS
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """
+    Text as far as the cache key is concerned: Unicode normalized, runs of
+    spaces collapsed, trailing spaces and blank lines dropped. Line breaks
+    are kept, they carry the page markers and table rows.
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text)
+    lines = (re.sub(r"[ \t\f\v]+", " ", line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def llm_cache_key(text: str, instructions: Optional[str], model_name: str) -> str:
+    """
+    Key of an extraction prompt: its normalized inputs, the model and the
+    system prompt, so editing the prompt does not serve stale responses.
+    """
+    return cache_key(
+        normalize_text(text), normalize_text(instructions), model_name, PROMPT_PREFIX
+    )
+
+
+class Uncached(NamedTuple):
+    """
+    A response `get_or_call` returns without storing it, one that another
+    model gave than the one in its key. Calls coalesced onto it get it too.
+    """
+
+    value: Any
+
+
+class MemoryBackend:
+    """
+    Responses held in this process, least recently used evicted first
+    past `max_entries`, each one expiring `ttl` seconds after it was stored.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SqliteBackend:
+    """
+    Responses stored in a SQLite file, shared by every process on the host
+    (API workers, the batch CLI). Same eviction as `MemoryBackend`.
+    """
+
+    def __init__(self, path: str, max_entries: int, ttl: float):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires REAL NOT NULL, used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM responses WHERE key = ? AND expires >= ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + self.ttl, now),
+            )
+            self._db.execute("DELETE FROM responses WHERE expires < ?", (now,))
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                "ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+class LLMCache:
+    """
+    Exact-match cache of LLM responses. Identical calls made while one is
+    in flight wait for it instead of calling the model again, even when
+    nothing is stored (`backend` None).
+    """
+
+    name = "llm"
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.counts = {"hit": 0, "miss": 0, "coalesced": 0}
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    def _record(self, result: str):
+        self.counts[result] += 1
+        CACHE_REQUESTS.inc(cache=self.name, result=result)
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.backend.get(key) if self.backend is not None else None
+        self._record("miss" if value is None else "hit")
+        return value
+
+    def put(self, key: str, value: Any):
+        if self.backend is not None and value is not None:
+            self.backend.put(key, value)
+
+    def in_flight(self, key: str) -> Optional[asyncio.Future]:
+        return self._in_flight.get(key)
+
+    async def get_or_call(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        The stored response for `key`, or the result of `call()` stored for
+        next time, unless it is `Uncached`.
+        """
+        value = self.backend.get(key) if self.backend is not None else None
+        if value is not None:
+            self._record("hit")
+            return value
+        task = self._in_flight.get(key)
+        if task is not None:
+            self._record("coalesced")
+        else:
+            self._record("miss")
+            # The call runs on its own, so one caller going away does not
+            # cancel it for the others
+            task = asyncio.ensure_future(call())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Future):
+        self._in_flight.pop(key, None)
+        if (
+            not task.cancelled()
+            and task.exception() is None
+            and not isinstance(task.result(), Uncached)
+        ):
+            self.put(key, task.result())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": LLM_CACHE_BACKEND,
+            "hits": self.counts["hit"],
+            "misses": self.counts["miss"],
+            "coalesced": self.counts["coalesced"],
+            "in_flight": len(self._in_flight),
+            "entries": len(self.backend) if self.backend is not None else 0,
+        }
+
+
+def make_backend(kind: str = LLM_CACHE_BACKEND):
+    if kind == "memory":
+        return MemoryBackend(LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL)
+    if kind == "sqlite":
+        return SqliteBackend(
+            os.path.join(CACHE_DIR, "llm.sqlite3"), LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL
+        )
+    return None
+
+
+llm_cache = LLMCache(make_backend())
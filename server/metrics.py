@@ -0,0 +1,317 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+# Stage latencies range from milliseconds (relevance) to minutes (OCR of a manual)
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Metric updates made inside `collect` are buffered here instead of applied,
+# so worker processes can send them back to the server's registry
+_local = threading.local()
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(
+            name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        for name, value in labels.items()
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """
+    A metric family, one value per combination of label values.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {list(self.labelnames)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _record(self, method: str, value: float, labels: Dict[str, Any]):
+        collector = getattr(_local, "collector", None)
+        if collector is not None:
+            collector.append((self.name, method, value, labels))
+        else:
+            getattr(self, f"_{method}")(value, self._key(labels))
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        self._record("inc", amount, labels)
+
+    def _inc(self, amount: float, key: Tuple[str, ...]):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            (self.name, dict(zip(self.labelnames, key)), value) for key, value in items
+        ]
+
+
+class Gauge(Metric):
+    """
+    A value set directly, or read from `fn` every time metrics are scraped.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, *args, fn: Optional[Callable[[], float]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fn = fn
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, fn: Callable[[], float]):
+        self.fn = fn
+
+    def samples(self):
+        if self.fn is not None:
+            return [(self.name, {}, float(self.fn()))]
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            (self.name, dict(zip(self.labelnames, key)), value) for key, value in items
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        self._record("observe", value, labels)
+
+    def _observe(self, value: float, key: Tuple[str, ...]):
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(counts), total)) for key, (counts, total) in self._values.items()]
+        samples = []
+        for key, (counts, total) in items:
+            labels = dict(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, counts):
+                samples.append(
+                    (f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, count)
+                )
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, counts[-1]))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> Metric:
+        return self._metrics[name]
+
+    def render(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(
+    Histogram("extract_stage_seconds", "Time spent in each pipeline stage.", ["stage"])
+)
+PAGES = REGISTRY.register(
+    Counter(
+        "extract_pages_total",
+        "Pages read, by source: text_layer, ocr or reused (page store).",
+        ["source"],
+    )
+)
+LLM_TOKENS = REGISTRY.register(
+    Counter(
+        "llm_tokens_total",
+        "Tokens sent (prompt) and received (completion) per model.",
+        ["model", "direction"],
+    )
+)
+LLM_REQUESTS = REGISTRY.register(
+    Counter("llm_requests_total", "Chat model calls per model.", ["model"])
+)
+LLM_RETRIES = REGISTRY.register(
+    Counter(
+        "llm_retries_total",
+        "Chat model calls retried, by model and error.",
+        ["model", "reason"],
+    )
+)
+LLM_FALLBACKS = REGISTRY.register(
+    Counter(
+        "llm_fallbacks_total",
+        "Calls sent to the fallback model because their model was saturated.",
+        ["model", "fallback"],
+    )
+)
+COMPACTION_TOKENS = REGISTRY.register(
+    Counter(
+        "compaction_tokens_total",
+        "Estimated page text tokens before and after compaction.",
+        ["state"],
+    )
+)
+CACHE_REQUESTS = REGISTRY.register(
+    Counter(
+        "cache_requests_total", "Cache lookups by cache and result.", ["cache", "result"]
+    )
+)
+JOBS = REGISTRY.register(
+    Counter("extract_jobs_total", "Finished extractions by status.", ["status"])
+)
+JOBS_QUEUED = REGISTRY.register(
+    Gauge("extract_jobs_queued", "Extractions waiting for a free slot.")
+)
+JOBS_IN_FLIGHT = REGISTRY.register(
+    Gauge("extract_jobs_in_flight", "Extractions currently running.")
+)
+
+
+@contextmanager
+def stage(name: str, timings: Optional[Dict[str, float]] = None):
+    """
+    Time a pipeline stage into `extract_stage_seconds`, and add it to
+    `timings` for a per-request breakdown if given.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def collect(fn: Callable, *args, **kwargs) -> Tuple[Any, List[tuple]]:
+    """
+    Run `fn` and return its result with the metric updates it made,
+    for functions run in worker processes whose metrics would be lost.
+    Apply the updates in the server with `replay`.
+    """
+    previous = getattr(_local, "collector", None)
+    _local.collector = []
+    try:
+        result = fn(*args, **kwargs)
+        return result, _local.collector
+    finally:
+        _local.collector = previous
+
+
+def replay(updates: List[tuple], timings: Optional[Dict[str, float]] = None):
+    """
+    Apply metric updates returned by `collect`, adding stage times to `timings`.
+    """
+    for name, method, value, labels in updates:
+        metric = REGISTRY.get(name)
+        getattr(metric, method)(value, **labels)
+        if timings is not None and metric is STAGE_SECONDS:
+            timings[labels["stage"]] = timings.get(labels["stage"], 0.0) + value
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """
+    Format a timing breakdown as a Server-Timing header value, in milliseconds.
+    """
+    return ", ".join(
+        f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()
+    )
+
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """
+    Count chat model calls and the tokens they report, per model.
+    Streamed calls report no token usage, only the call is counted.
+    """
+
+    def __init__(self):
+        self._models: Dict[UUID, str] = {}
+
+    def on_chat_model_start(
+        self, serialized: Dict[str, Any], messages: List, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        params = kwargs.get("invocation_params") or {}
+        self._models[run_id] = params.get("model_name") or params.get("model") or "unknown"
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        llm_output = response.llm_output or {}
+        # The model that answered, which may be a fallback of the one asked for
+        requested = self._models.pop(run_id, None)
+        model = llm_output.get("model_name") or requested or "unknown"
+        LLM_REQUESTS.inc(model=model)
+        usage = llm_output.get("token_usage") or {}
+        if usage.get("prompt_tokens"):
+            LLM_TOKENS.inc(usage["prompt_tokens"], model=model, direction="prompt")
+        if usage.get("completion_tokens"):
+            LLM_TOKENS.inc(usage["completion_tokens"], model=model, direction="completion")
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._models.pop(run_id, None)
+
+
+token_usage = TokenUsageHandler()
@@ -1,10 +1,55 @@
+import logging
 import os
-from typing import Optional
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
 
-from langchain_openai import ChatOpenAI
+import httpx
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    BaseCallbackHandler,
+    CallbackManagerForLLMRun,
+)
 from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage, get_buffer_string
+from langchain_core.outputs import ChatGenerationChunk, ChatResult, LLMResult
 
-from server.constants import OPENAI_API_KEY
+from server.constants import (
+    FALLBACK_MODEL,
+    LLM_MAX_CONNECTIONS,
+    LLM_RATE_LIMITS,
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+)
+from server.scheduler import COMPLETION_TOKENS_ESTIMATE, Scheduler, parse_rate_limits
+from server.text_utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def _http_clients() -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """One keep-alive connection pool shared by every model, opened on first call."""
+    limits = httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS
+    )
+    return httpx.Client(limits=limits), httpx.AsyncClient(limits=limits)
+
+
+def _chat_openai(model: str) -> BaseChatModel:
+    # langchain_openai pulls in openai and tiktoken, only needed once a model is called
+    from langchain_openai import ChatOpenAI
+
+    http_client, http_async_client = _http_clients()
+    # Retries are left to the scheduler, which knows about the other calls
+    return ChatOpenAI(
+        model=model,
+        temperature=0,
+        api_key=OPENAI_API_KEY,
+        base_url=OPENAI_BASE_URL,
+        max_retries=0,
+        http_client=http_client,
+        http_async_client=http_async_client,
+    )
 
 
 def get_supported_models():
@@ -12,16 +57,12 @@ def get_supported_models():
     models = {}
     if "OPENAI_API_KEY" in os.environ:
         models["gpt-3.5-turbo"] = {
-            "chat_model": ChatOpenAI(
-                model="gpt-3.5-turbo", temperature=0, api_key=OPENAI_API_KEY
-            ),
+            "chat_model": _chat_openai,
             "description": "The latest GPT-3.5 Turbo.",
         }
 
         models["gpt-4-turbo"] = {
-            "chat_model": ChatOpenAI(
-                model="gpt-4-turbo", temperature=0, api_key=OPENAI_API_KEY
-            ),
+            "chat_model": _chat_openai,
             "description": "The latest GPT-4 Turbo model with vision capabilities.",
         }
 
@@ -31,11 +72,147 @@ def get_supported_models():
 SUPPORTED_MODELS = get_supported_models()
 DEFAULT_MODEL = "gpt-4-turbo"
 
+if FALLBACK_MODEL is not None and FALLBACK_MODEL not in SUPPORTED_MODELS:
+    logger.warning("FALLBACK_MODEL %s is not a supported model, ignored.", FALLBACK_MODEL)
+scheduler = Scheduler(
+    parse_rate_limits(LLM_RATE_LIMITS),
+    fallback_model=FALLBACK_MODEL if FALLBACK_MODEL in SUPPORTED_MODELS else None,
+)
+
+
+@lru_cache(maxsize=None)
+def _client(model_name: str) -> BaseChatModel:
+    """The model's client, built by its `chat_model` factory on first use."""
+    return SUPPORTED_MODELS[model_name]["chat_model"](model_name)
+
+
+def _used_tokens(result: ChatResult) -> Optional[int]:
+    usage = (result.llm_output or {}).get("token_usage") or {}
+    return usage.get("total_tokens")
+
+
+def _answered_by(generation_info: Optional[Dict[str, Any]], name: str) -> Dict[str, Any]:
+    return {**(generation_info or {}), "answered_by": name}
+
+
+class AnsweringModels(BaseCallbackHandler):
+    """
+    Collects the models that answered the chat model calls of a run, read
+    from the `answered_by` generation info `ScheduledChatModel` sets.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self.names: Set[str] = set()
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        for generations in response.generations:
+            for generation in generations:
+                name = (generation.generation_info or {}).get("answered_by")
+                if name is not None:
+                    self.names.add(name)
+
+    def fell_back(self, model_name: str) -> bool:
+        """Whether another model than `model_name` answered any of the calls."""
+        return bool(self.names - {model_name})
+
+
+class ScheduledChatModel(BaseChatModel):
+    """
+    A supported model called through the scheduler: within its rate limits,
+    retried with backoff, and spilling over to the fallback model when saturated.
+    Generations carry the model that answered as `answered_by`.
+    """
+
+    model_name: str
+
+    @property
+    def _llm_type(self) -> str:
+        return "scheduled"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name}
+
+    def _reserved_tokens(self, messages: List[BaseMessage]) -> int:
+        return estimate_tokens(get_buffer_string(messages)) + COMPLETION_TOKENS_ESTIMATE
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tokens = self._reserved_tokens(messages)
+        name, result = scheduler.call_sync(
+            self.model_name,
+            tokens,
+            lambda name: _client(name)._generate(messages, stop, run_manager, **kwargs),
+        )
+        scheduler.settle(name, tokens, _used_tokens(result))
+        for generation in result.generations:
+            generation.generation_info = _answered_by(generation.generation_info, name)
+        return result
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tokens = self._reserved_tokens(messages)
+        name, result = await scheduler.call(
+            self.model_name,
+            tokens,
+            lambda name: _client(name)._agenerate(messages, stop, run_manager, **kwargs),
+        )
+        scheduler.settle(name, tokens, _used_tokens(result))
+        for generation in result.generations:
+            generation.generation_info = _answered_by(generation.generation_info, name)
+        return result
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+
+        async def answer(name: str) -> AsyncIterator[ChatGenerationChunk]:
+            first = True
+            async for chunk in _client(name)._astream(messages, stop, run_manager, **kwargs):
+                if first:
+                    # chunks are merged, tagging the first one tags the generation
+                    chunk.generation_info = _answered_by(chunk.generation_info, name)
+                    first = False
+                yield chunk
+
+        # Streamed calls report no usage, their reservation stands
+        async for chunk in scheduler.stream(
+            self.model_name, self._reserved_tokens(messages), answer
+        ):
+            yield chunk
+
+    def _combine_llm_outputs(self, llm_outputs: List[Optional[dict]]) -> dict:
+        combined: Dict[str, Any] = {"token_usage": {}}
+        for output in filter(None, llm_outputs):
+            if "model_name" in output:
+                combined["model_name"] = output["model_name"]
+            for key, value in (output.get("token_usage") or {}).items():
+                combined["token_usage"][key] = combined["token_usage"].get(key, 0) + (
+                    value or 0
+                )
+        return combined
+
 
 def get_model(model_name: Optional[str] = None) -> BaseChatModel:
     """Get the model."""
     if model_name is None:
-        return SUPPORTED_MODELS[DEFAULT_MODEL]["chat_model"]
+        return ScheduledChatModel(model_name=DEFAULT_MODEL)
     else:
         supported_model_names = list(SUPPORTED_MODELS.keys())
         if model_name not in supported_model_names:
@@ -44,4 +221,4 @@ def get_model(model_name: Optional[str] = None) -> BaseChatModel:
                 f"Supported models: {supported_model_names}"
             )
         else:
-            return SUPPORTED_MODELS[model_name]["chat_model"]
+            return ScheduledChatModel(model_name=model_name)
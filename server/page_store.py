@@ -0,0 +1,228 @@
+import base64
+import io
+import json
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+if TYPE_CHECKING:
+    from doctr.io import Page
+
+from server.cache import DiskCache, cache_key, page_cache
+from server.constants import (
+    ENHANCE_MIN_CONFIDENCE,
+    ENHANCE_MIN_WORDS,
+    ENHANCE_MODE,
+    ENHANCE_TASK,
+    OCR_DET_ARCH,
+    OCR_RECO_ARCH,
+    PAGE_HASH_SIZE,
+    PAGE_HASH_TOLERANCE,
+    PAGE_SIGNATURE_TOLERANCE,
+    PAGE_SIGNATURE_WIDTH,
+)
+
+# Side of the grid kept in entry file names, indexed without reading entries
+INDEX_SIZE = 8
+# Entries added or evicted by other processes are picked up this often
+INDEX_REFRESH_SECONDS = 10
+
+
+def page_hash(image: np.ndarray, hash_size: int = PAGE_HASH_SIZE) -> np.ndarray:
+    """
+    Perceptual hash of a page: its grayscale averaged over a `hash_size` grid.
+    Re-rendering or re-scanning noise averages out, changed text does not.
+    """
+    gray = Image.fromarray(image).convert("L").resize((hash_size, hash_size), Image.BOX)
+    return np.asarray(gray, dtype=np.uint8).ravel()
+
+
+def index_hash(image_hash: np.ndarray, index_size: int = INDEX_SIZE) -> np.ndarray:
+    """
+    The page hash averaged down to an `index_size` grid. Averaging never
+    widens a difference, so pages within the tolerance stay within it here.
+    """
+    side = int(np.sqrt(image_hash.size))
+    grid = Image.fromarray(image_hash.reshape(side, side))
+    return np.asarray(grid.resize((index_size, index_size), Image.BOX), dtype=np.uint8).ravel()
+
+
+def page_signature(image: np.ndarray, width: int = PAGE_SIGNATURE_WIDTH) -> np.ndarray:
+    """
+    The page's grayscale downsampled to `width` pixels wide, fine enough
+    to tell a single changed character apart.
+    """
+    gray = Image.fromarray(image).convert("L")
+    height = max(1, round(width * gray.height / gray.width))
+    return np.asarray(gray.resize((width, height), Image.BOX), dtype=np.uint8)
+
+
+def _encode_signature(signature: np.ndarray) -> str:
+    buffer = io.BytesIO()
+    Image.fromarray(signature).save(buffer, "PNG", optimize=True)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def _decode_signature(encoded: str) -> np.ndarray:
+    return np.asarray(Image.open(io.BytesIO(base64.b64decode(encoded))), dtype=np.uint8)
+
+
+class PageStore:
+    """
+    DocTR results of single pages, looked up by page hash so that pages
+    shared between documents or revisions are only recognized once.
+
+    Entry names carry the engine and the page's `index_hash`, so candidates
+    are found from the directory listing alone. A candidate is reused only
+    once its full hash and its `page_signature` match the new page too.
+    """
+
+    def __init__(
+        self,
+        cache: DiskCache,
+        tolerance: int = PAGE_HASH_TOLERANCE,
+        signature_tolerance: int = PAGE_SIGNATURE_TOLERANCE,
+    ):
+        self.cache = cache
+        self.tolerance = tolerance
+        self.signature_tolerance = signature_tolerance
+        self.engine = f"doctr:{OCR_DET_ARCH}:{OCR_RECO_ARCH}"
+        if ENHANCE_MODE != "off":
+            # enhanced readings are kept apart from plain ones
+            self.engine += (
+                f":{ENHANCE_MODE}:{ENHANCE_TASK}:{ENHANCE_MIN_CONFIDENCE}:{ENHANCE_MIN_WORDS}"
+            )
+        self._prefix = cache_key(self.engine)[:12] + "-"
+        self._index: Dict[str, np.ndarray] = {}
+        self._keys: List[str] = []
+        self._matrix = np.empty((0, INDEX_SIZE * INDEX_SIZE), dtype=np.int16)
+        self._refreshed = 0.0
+        self._lock = threading.Lock()
+
+    def _key(self, image_hash: np.ndarray) -> str:
+        return (
+            self._prefix
+            + index_hash(image_hash).tobytes().hex()
+            + "-"
+            + cache_key(image_hash.tobytes().hex())[:16]
+        )
+
+    def _parse_key(self, key: str) -> Optional[np.ndarray]:
+        """The index hash in an entry name, None for other engines."""
+        if not key.startswith(self._prefix):
+            return None
+        try:
+            return np.frombuffer(bytes.fromhex(key.split("-")[1]), dtype=np.uint8)
+        except (IndexError, ValueError):
+            return None
+
+    def _rebuild(self):
+        self._keys = list(self._index)
+        if self._keys:
+            self._matrix = np.stack([self._index[key] for key in self._keys]).astype(np.int16)
+        else:
+            self._matrix = np.empty((0, INDEX_SIZE * INDEX_SIZE), dtype=np.int16)
+
+    def _refresh(self):
+        """
+        Re-list the entries every INDEX_REFRESH_SECONDS, to see the ones other
+        processes added or evicted. Only file names are read.
+        """
+        now = time.monotonic()
+        if now - self._refreshed < INDEX_REFRESH_SECONDS:
+            return
+        self._refreshed = now
+        index = {}
+        for key in self.cache.keys():
+            coarse = self._index.get(key)
+            if coarse is None:
+                coarse = self._parse_key(key)
+            if coarse is not None:
+                index[key] = coarse
+        self._index = index
+        self._rebuild()
+
+    def _candidates(self, image_hash: np.ndarray) -> List[str]:
+        """Keys of the entries whose index hash is within the tolerance, closest first."""
+        with self._lock:
+            self._refresh()
+            keys, matrix = self._keys, self._matrix
+        if not keys:
+            return []
+        # +1 for the rounding of both averaged hashes
+        distances = np.abs(matrix - index_hash(image_hash).astype(np.int16)).max(axis=1)
+        close = np.flatnonzero(distances <= self.tolerance + 1)
+        return [keys[i] for i in close[np.argsort(distances[close], kind="stable")]]
+
+    def _matches(self, entry: dict, image_hash: np.ndarray, signature: np.ndarray) -> bool:
+        stored_hash = np.frombuffer(bytes.fromhex(entry["hash"]), dtype=np.uint8)
+        if stored_hash.shape != image_hash.shape:
+            return False
+        if np.abs(stored_hash.astype(np.int16) - image_hash).max() > self.tolerance:
+            return False
+        stored = _decode_signature(entry["signature"])
+        if stored.shape != signature.shape:
+            return False
+        return np.abs(stored.astype(np.int16) - signature).max() <= self.signature_tolerance
+
+    def find(self, image_hash: np.ndarray, index: int, image: np.ndarray) -> Optional["Page"]:
+        """
+        Rebuild the DocTR page of a matching stored page, if there is one.
+        Geometries are relative so they apply to the new image as is.
+        """
+        signature = None
+        for key in self._candidates(image_hash):
+            entry = self.cache.peek(key)
+            if entry is None:
+                # evicted since the last listing
+                with self._lock:
+                    if self._index.pop(key, None) is not None:
+                        self._rebuild()
+                continue
+            if signature is None:
+                signature = page_signature(image)
+            if self._matches(entry, image_hash, signature):
+                # count the hit and refresh the entry for eviction
+                entry = self.cache.get(key) or entry
+                break
+        else:
+            self.cache.record(hit=False)
+            return None
+        from doctr.io import Block, Page
+
+        exported = entry["page"]
+        return Page(
+            image,
+            [Block.from_dict(block) for block in exported["blocks"]],
+            index,
+            image.shape[:2],
+            exported["orientation"],
+            exported["language"],
+        )
+
+    def add(self, image_hash: np.ndarray, page: "Page", image: np.ndarray):
+        """
+        Save a page's words, geometry and confidences for reuse, with the
+        signature of its image to confirm later matches.
+        """
+        key = self._key(image_hash)
+        # round trip through JSON to turn numpy scalars into plain floats
+        exported = json.loads(json.dumps(page.export(), default=float))
+        self.cache.put(
+            key,
+            {
+                "engine": self.engine,
+                "hash": image_hash.tobytes().hex(),
+                "signature": _encode_signature(page_signature(image)),
+                "page": exported,
+            },
+        )
+        with self._lock:
+            self._index[key] = index_hash(image_hash)
+            self._rebuild()
+
+
+page_store = PageStore(page_cache)
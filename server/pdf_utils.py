@@ -1,27 +1,55 @@
 import os
-from multiprocessing import Pool, cpu_count
-
+import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count, get_context
+from tempfile import TemporaryDirectory
+from typing import List, Optional
+
+import numpy as np
 import ocrmypdf
 import pdfplumber
+import pypdfium2 as pdfium
 from langchain_community.document_loaders import PDFPlumberLoader
 from PIL import Image
-from server.constants import TEMP_DIR
-from server.DE_GAN.enhance import enhance_image
+from reportlab.lib.utils import ImageReader
+from server.metrics import PAGES, stage
+from server.pdf_writer import PartedPdfWriter
+from server.triage import usable_text_layers
 
 
-def perform_ocr(input_pdf: str, output_pdf: str):
+def perform_ocr(input_pdf: str, output_pdf: Optional[str] = None) -> List[str]:
     """
     Run OCR on a PDF file.
     This allows PDFs with scanned documents to also be read by text extraction tools.
+    Pages that already have a usable text layer are kept as they are.
+    Returns the text of each page, the OCR'd PDF is kept only if `output_pdf` is given.
     """
-    ocrmypdf.ocr(
-        input_file=input_pdf,
-        output_file=output_pdf,
-        deskew=True,
-        rotate_pages=True,
-        force_ocr=True,
-        # use_threads=4,  # Not stable on macOS
-    )
+    layers = usable_text_layers(input_pdf)
+    needs_ocr = [index for index, layer in enumerate(layers) if layer is None]
+    if not needs_ocr:
+        if output_pdf is not None:
+            shutil.copyfile(input_pdf, output_pdf)
+        return layers
+    with TemporaryDirectory() as tmpdir:
+        if output_pdf is None:
+            output_pdf = os.path.join(tmpdir, "ocr.pdf")
+        with stage("ocrmypdf"):
+            ocrmypdf.ocr(
+                input_file=input_pdf,
+                output_file=output_pdf,
+                deskew=True,
+                rotate_pages=True,
+                force_ocr=True,
+                pages=",".join(str(index + 1) for index in needs_ocr),
+                # use_threads=4,  # Not stable on macOS
+            )
+        PAGES.inc(len(needs_ocr), source="ocr")
+        with stage("extract_text"), pdfplumber.open(output_pdf) as pdf:
+            return [
+                layer if layer is not None else pdf.pages[index].extract_text() or ""
+                for index, layer in enumerate(layers)
+            ]
 
 
 def extract_text(pdf_path):
@@ -58,35 +86,154 @@ def convert_pdf_to_images(pdf_path, output_dir, debug=False):
     return image_paths
 
 
-def process_image_page(image):
+def iter_pdf_images(pdf_path, resolution=72):
+    """
+    Rasterize PDF pages one at a time as grayscale uint8 arrays, without files.
+    """
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        for page in pdf:
+            bitmap = page.render(scale=resolution / 72, grayscale=True)
+            yield bitmap.to_numpy().reshape(bitmap.height, bitmap.width).copy()
+            page.close()
+    finally:
+        pdf.close()
+
+
+def enhance_page(page: np.ndarray, task="deblur") -> np.ndarray:
+    """
+    Use DE-GAN to enhance a grayscale uint8 page in memory.
+    """
+    # DE-GAN loads TensorFlow and Keras, only imported where pages are enhanced
+    from server.DE_GAN.enhance import enhance_images
+
+    enhanced = enhance_images(task, [page.astype(np.float32) / 255.0])[0]
+    return np.rint(np.clip(enhanced, 0, 1) * 255).astype(np.uint8)
+
+
+def process_image_page(image, output_dir, task="deblur"):
     """
     Use DE-GAN to enhance the image.
     """
-    image_name = image.split("/")[-1]
-    return enhance_image("deblur", image, TEMP_DIR, image_name)
+    from server.DE_GAN.enhance import enhance_image
 
+    image_name = os.path.basename(image)
+    return enhance_image(task, image, output_dir, image_name)
 
-def process_images_with_multiprocessing(image_paths):
-    """Process images in parallel using multiprocessing."""
-    with Pool(cpu_count()) as pool:
-        processed_images = pool.imap_unordered(process_image_page, image_paths)
-    return image_paths
 
+def _init_enhance_worker(threads, task):
+    """
+    Cap the threads TensorFlow uses so workers don't oversubscribe the cores,
+    then load the generator once for this worker.
+    """
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    import tensorflow as tf
 
-def images_to_pdf(image_paths, output_pdf_path):
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    from server.DE_GAN.enhance import init_worker
+
+    init_worker((task,))
+
+
+def _map_in_order(fn, items, task, workers=None, max_in_flight=None):
     """
-    Convert the processed images (from file paths) back to a single PDF file.
+    Run `fn(item, ...)` over a process pool, yielding results in input order.
+    Items are pulled from the iterable only as results are consumed, so at
+    most `max_in_flight` items are held in memory at once.
     """
-    # Open the first image to create the initial PDF
-    with Image.open(image_paths[0]) as img:
-        img = img.convert("RGB")  # Convert the first image to RGB to start the PDF
-        img_list = []
+    workers = workers or cpu_count()
+    threads = max(1, cpu_count() // workers)
+    max_in_flight = max_in_flight or 2 * workers
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=get_context("spawn"),
+        initializer=_init_enhance_worker,
+        initargs=(threads, task),
+    ) as pool:
+        in_flight = deque()
+        for item in items:
+            if len(in_flight) >= max_in_flight:
+                yield in_flight.popleft().result()
+            in_flight.append(pool.submit(fn, item, task))
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def _process_image_path(image_path_and_dir, task):
+    image_path, output_dir = image_path_and_dir
+    return process_image_page(image_path, output_dir, task)
+
+
+def process_images_with_multiprocessing(
+    image_paths, output_dir, task="deblur", workers=None, max_in_flight=None
+):
+    """
+    Process images in parallel using multiprocessing.
+    Enhanced pages are written to `output_dir` and returned in page order.
+    At most `max_in_flight` pages are queued or being processed at once.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    return list(
+        _map_in_order(
+            _process_image_path,
+            ((image_path, output_dir) for image_path in image_paths),
+            task,
+            workers,
+            max_in_flight,
+        )
+    )
+
+
+class PdfImageWriter(PartedPdfWriter):
+    """
+    Append page images to a PDF one at a time, so only the compressed
+    output is kept rather than every page image. Saved in parts of
+    `pages_per_part` pages, see `PartedPdfWriter`.
+    """
+
+    def __init__(self, output_pdf_path, resolution=72, pages_per_part=32):
+        super().__init__(output_pdf_path, pages_per_part)
+        self.resolution = resolution
 
-        # Process the rest of the images
-        for image_path in image_paths[1:]:
-            with Image.open(image_path) as img_file:
-                img_list.append(img_file.convert("RGB"))
+    def add_page(self, image):
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        width = image.width * 72 / self.resolution
+        height = image.height * 72 / self.resolution
+        canvas = self._page_canvas()
+        canvas.setPageSize((width, height))
+        canvas.drawImage(ImageReader(image), 0, 0, width=width, height=height)
+        self._end_page()
 
-        # Save all images into a PDF file
-        img.save(output_pdf_path, save_all=True, append_images=img_list)
-        print(f"PDF processing complete. Saved to: {output_pdf_path}")
+
+def enhance_pdf(
+    input_pdf, output_pdf, task="deblur", resolution=72, workers=None, max_in_flight=None
+):
+    """
+    Enhance every page of a PDF with DE-GAN and write the result as a new PDF.
+    Pages stream from rasterization through the worker pool into the writer
+    as numpy arrays; no intermediate image files are written.
+    """
+    with PdfImageWriter(output_pdf, resolution) as writer:
+        for page in _map_in_order(
+            enhance_page,
+            iter_pdf_images(input_pdf, resolution),
+            task,
+            workers,
+            max_in_flight,
+        ):
+            writer.add_page(page)
+    return output_pdf
+
+
+def images_to_pdf(image_paths, output_pdf_path):
+    """
+    Convert the processed images (from file paths) back to a single PDF file.
+    """
+    with PdfImageWriter(output_pdf_path) as writer:
+        for image_path in image_paths:
+            with Image.open(image_path) as img:
+                writer.add_page(img.convert("RGB"))
+    print(f"PDF processing complete. Saved to: {output_pdf_path}")
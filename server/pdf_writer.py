@@ -0,0 +1,99 @@
+import os
+from typing import List, Optional, Tuple
+
+import PyPDF2
+from reportlab.pdfgen.canvas import Canvas
+
+
+class PartedPdfWriter:
+    """
+    A PDF drawn page by page on reportlab canvases.
+    A canvas holds its pages in memory until it is saved, so every
+    `pages_per_part` pages are saved as a part, joined when closing.
+    Pages of other PDFs can be copied in between as they are.
+    """
+
+    def __init__(self, output_pdf_path: str, pages_per_part: int = 32):
+        self.output_pdf_path = output_pdf_path
+        self.pages_per_part = pages_per_part
+        self.parts: List[str] = []
+        # (PDF, first page, end page) ranges making up the output, in order
+        self.sections: List[Tuple[str, int, int]] = []
+        self.canvas: Optional[Canvas] = None
+        self.pages = 0
+        self._part_pages = 0
+
+    def _page_canvas(self) -> Canvas:
+        """The canvas to draw the next page on, starting a part if needed."""
+        if self.canvas is None:
+            self.parts.append(f"{self.output_pdf_path}.part{len(self.parts)}")
+            self.canvas = Canvas(self.parts[-1], pageCompression=1)
+        return self.canvas
+
+    def _end_page(self):
+        self.canvas.showPage()
+        self.pages += 1
+        self._part_pages += 1
+        if self._part_pages == self.pages_per_part:
+            self._save_part()
+
+    def _save_part(self):
+        self.canvas.save()
+        self.canvas = None
+        self.sections.append((self.parts[-1], 0, self._part_pages))
+        self._part_pages = 0
+
+    def copy_page(self, pdf_path: str, index: int):
+        """Take page `index` of the PDF at `pdf_path` over as it is."""
+        if self.canvas is not None:
+            self._save_part()
+        if self.sections and self.sections[-1][0] == pdf_path and self.sections[-1][2] == index:
+            self.sections[-1] = (pdf_path, self.sections[-1][1], index + 1)
+        else:
+            self.sections.append((pdf_path, index, index + 1))
+        self.pages += 1
+
+    def _join_parts(self):
+        """
+        Join the saved parts into the output PDF. The merger copies their
+        objects over from the files as it writes, without loading them all.
+        """
+        if len(self.sections) == 1 and self.sections[0][0] in self.parts:
+            os.replace(self.parts[0], self.output_pdf_path)
+            return
+        merger = PyPDF2.PdfFileMerger()
+        try:
+            for path, start, end in self.sections:
+                merger.append(path, pages=(start, end))
+            merger.write(self.output_pdf_path)
+        finally:
+            merger.close()
+            for part in self.parts:
+                os.remove(part)
+
+    def close(self):
+        if not self.sections and self.canvas is None:
+            # An empty document, saved as the single blank page reportlab writes
+            self._page_canvas()
+        if self.canvas is not None:
+            self._save_part()
+        self._join_parts()
+
+    def abort(self):
+        """Remove the parts saved so far, leaving no output."""
+        self.canvas = None
+        for part in self.parts:
+            try:
+                os.remove(part)
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        # an interrupted document is not saved as if it were complete
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
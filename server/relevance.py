@@ -0,0 +1,140 @@
+import math
+import re
+from collections import Counter
+from typing import List, Sequence
+
+from server.constants import RELEVANCE_NEIGHBOURS, RELEVANCE_THRESHOLD
+
+# Words that tend to appear on troubleshooting, maintenance and safety pages
+TROUBLESHOOTING_TERMS = (
+    "troubleshooting problem problems solution cause causes remedy fix error "
+    "fault faulty failure fails check inspect replace adjust repair reset "
+    "maintenance lubricate clean tighten loose noise noisy squeak vibration "
+    "not working does not will not cannot stops warning caution danger "
+    "battery power display console belt motor"
+)
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def _terms(text: str) -> List[str]:
+    """
+    Character trigrams of each word, so OCR misspellings still share
+    most of their terms with the correct spelling.
+    """
+    terms = []
+    for word in WORD_PATTERN.findall(text.lower()):
+        if len(word) < 3:
+            continue
+        padded = f" {word} "
+        terms.extend(padded[i : i + 3] for i in range(len(padded) - 2))
+    return terms
+
+
+class PageIndex:
+    """
+    BM25 index over the pages of a single document, which can be added
+    window by window as they are read.
+    """
+
+    def __init__(self, page_texts: Sequence[str] = (), k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_counts: List[Counter] = []
+        self.lengths: List[int] = []
+        self.document_frequency: Counter = Counter()
+        self.add(page_texts)
+
+    def add(self, page_texts: Sequence[str]):
+        """Index more pages, updating the term weights of the whole document."""
+        term_counts = [Counter(_terms(text)) for text in page_texts]
+        self.term_counts.extend(term_counts)
+        self.lengths.extend(sum(counts.values()) for counts in term_counts)
+        for counts in term_counts:
+            self.document_frequency.update(counts.keys())
+        self.average_length = sum(self.lengths) / max(len(self.lengths), 1) or 1
+        pages = len(self.term_counts)
+        self.idf = {
+            term: math.log(1 + (pages - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in self.document_frequency.items()
+        }
+
+    def scores(self, query: str, start: int = 0) -> List[float]:
+        """Scores of the pages from `start` on."""
+        query_terms = Counter(_terms(query))
+        scores = []
+        for counts, length in zip(self.term_counts[start:], self.lengths[start:]):
+            norm = self.k1 * (1 - self.b + self.b * length / self.average_length)
+            score = 0.0
+            for term, query_count in query_terms.items():
+                frequency = counts.get(term)
+                if frequency:
+                    score += (
+                        query_count
+                        * self.idf[term]
+                        * frequency
+                        * (self.k1 + 1)
+                        / (frequency + norm)
+                    )
+            scores.append(score)
+        return scores
+
+
+class RelevanceFilter:
+    """
+    Selects the pages of a document worth sending to the LLM, window by
+    window as they are read. Pages are scored on an index of every page
+    read so far and kept relative to the best page so far, so a window
+    without troubleshooting content sends nothing once a relevant page
+    has been seen.
+    """
+
+    def __init__(
+        self,
+        threshold: float = RELEVANCE_THRESHOLD,
+        neighbours: int = RELEVANCE_NEIGHBOURS,
+        query: str = TROUBLESHOOTING_TERMS,
+    ):
+        self.threshold = threshold
+        self.neighbours = neighbours
+        self.query = query
+        self.index = PageIndex()
+        self.best = 0.0
+
+    def select(self, page_texts: Sequence[str]) -> List[int]:
+        """
+        Indices, within `page_texts`, of the pages scoring at least
+        `threshold` times the document's best page so far, plus `neighbours`
+        pages on either side of each. Every page is kept while no page
+        has matched the query yet.
+        """
+        if self.threshold <= 0 or not page_texts:
+            return list(range(len(page_texts)))
+        start = len(self.index.term_counts)
+        self.index.add(page_texts)
+        scores = self.index.scores(self.query, start)
+        self.best = max(self.best, max(scores))
+        if self.best == 0:
+            return list(range(len(page_texts)))
+        selected = set()
+        for index, score in enumerate(scores):
+            if score >= self.threshold * self.best:
+                first = max(0, index - self.neighbours)
+                last = min(len(page_texts) - 1, index + self.neighbours)
+                selected.update(range(first, last + 1))
+        return sorted(selected)
+
+
+def select_relevant_pages(
+    page_texts: Sequence[str],
+    threshold: float = RELEVANCE_THRESHOLD,
+    neighbours: int = RELEVANCE_NEIGHBOURS,
+    query: str = TROUBLESHOOTING_TERMS,
+) -> List[int]:
+    """
+    Indices of the pages worth sending to the LLM: those scoring at least
+    `threshold` times the best page's score, plus `neighbours` pages on
+    either side of each. A threshold of 0 keeps every page; raising it
+    trades recall for fewer tokens.
+    """
+    return RelevanceFilter(threshold, neighbours, query).select(page_texts)
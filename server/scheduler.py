@@ -0,0 +1,286 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from server.constants import (
+    FALLBACK_AFTER,
+    LLM_MAX_RETRIES,
+    LLM_RETRY_BASE_DELAY,
+    LLM_RETRY_MAX_DELAY,
+)
+from server.metrics import LLM_FALLBACKS, LLM_RETRIES
+
+# Limits are quoted per minute but enforced over shorter periods, so at most
+# this many seconds' worth of requests and tokens is sent at once
+BURST_SECONDS = 10
+# Completion tokens reserved per call, the API counts some against the limit
+# before it knows how many the answer takes
+COMPLETION_TOKENS_ESTIMATE = 1000
+
+
+def _retryable(error: Exception) -> bool:
+    # openai is slow to import, its errors only come from calls that loaded it already
+    import openai
+
+    return isinstance(
+        error,
+        (
+            openai.RateLimitError,
+            openai.APITimeoutError,
+            openai.APIConnectionError,
+            openai.InternalServerError,
+        ),
+    )
+
+
+def _rate_limited(error: Exception) -> bool:
+    import openai
+
+    return isinstance(error, openai.RateLimitError)
+
+
+def parse_rate_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    """
+    Per-minute limits given as "model=requests:tokens" pairs separated by
+    commas, as {model: (requests, tokens)}.
+    """
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        try:
+            model, rates = item.split("=")
+            requests, tokens = rates.split(":")
+            limits[model.strip()] = (float(requests), float(tokens))
+        except ValueError:
+            raise ValueError(
+                f"Wrong LLM_RATE_LIMITS entry {item}, please specify model=requests:tokens"
+            )
+    return limits
+
+
+class TokenBucket:
+    """
+    Refills at `per_minute` units a minute, up to BURST_SECONDS' worth.
+    Units are taken ahead of time: the level goes negative and later takers
+    wait for the debt to be paid, so callers are served in the order they ask.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = BURST_SECONDS):
+        self.rate = per_minute / 60
+        self.capacity = self.rate * burst_seconds
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Seconds until `amount` may be taken. More than the capacity only
+        needs a full bucket, or it would never fit.
+        """
+        self._refill()
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= amount
+
+    def block(self, seconds: float):
+        """Make the next taker wait at least `seconds`."""
+        self._refill()
+        self.level = min(self.level, -seconds * self.rate)
+
+
+class RateLimiter:
+    """
+    Requests and tokens per minute allowed for one model.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    def wait_time(self, tokens: int) -> float:
+        return max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+    def reserve(self, tokens: int) -> float:
+        """Take a request and `tokens`, returning how long to wait before sending it."""
+        wait = self.wait_time(tokens)
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        return wait
+
+    def pause(self, seconds: float):
+        self.requests.block(seconds)
+        self.tokens.block(seconds)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """The delay the API asked for in its rate limit headers, if any."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        if "retry-after-ms" in response.headers:
+            return float(response.headers["retry-after-ms"]) / 1000
+        if "retry-after" in response.headers:
+            return float(response.headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+class Scheduler:
+    """
+    Sends chat model calls within each model's rate limits, retrying rate
+    limited and failed calls with jittered exponential backoff. A call that
+    would wait more than `fallback_after` seconds for its model goes to
+    `fallback_model` instead when that one is less busy. Models without
+    limits only wait out the pauses rate limit errors ask for.
+    """
+
+    def __init__(
+        self,
+        limits: Dict[str, Tuple[float, float]],
+        fallback_model: Optional[str] = None,
+        fallback_after: float = FALLBACK_AFTER,
+        max_retries: int = LLM_MAX_RETRIES,
+        base_delay: float = LLM_RETRY_BASE_DELAY,
+        max_delay: float = LLM_RETRY_MAX_DELAY,
+    ):
+        self.limiters = {model: RateLimiter(*rates) for model, rates in limits.items()}
+        self.fallback_model = fallback_model
+        self.fallback_after = fallback_after
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # When models without limits were rate limited until, by the API
+        self._paused_until: Dict[str, float] = {}
+        # Sync calls may come from several threads
+        self._lock = threading.Lock()
+
+    def _wait_time(self, model: str, tokens: int) -> float:
+        limiter = self.limiters.get(model)
+        if limiter is not None:
+            return limiter.wait_time(tokens)
+        return max(0.0, self._paused_until.get(model, 0.0) - time.monotonic())
+
+    def _reserve(self, model: str, tokens: int) -> Tuple[str, float]:
+        """Pick the model to call and reserve its capacity, returning it with the wait."""
+        with self._lock:
+            wait = self._wait_time(model, tokens)
+            fallback = self.fallback_model
+            if (
+                wait > self.fallback_after
+                and fallback is not None
+                and fallback != model
+                and self._wait_time(fallback, tokens) < wait
+            ):
+                LLM_FALLBACKS.inc(model=model, fallback=fallback)
+                model = fallback
+            limiter = self.limiters.get(model)
+            if limiter is None:
+                return model, self._wait_time(model, tokens)
+            return model, limiter.reserve(tokens)
+
+    def settle(self, model: str, reserved: int, used: Optional[int]):
+        """
+        Charge the tokens a call used beyond its reservation. Unused ones are
+        not given back, the API counts the reservation against the limit too.
+        """
+        limiter = self.limiters.get(model)
+        if limiter is not None and used is not None and used > reserved:
+            with self._lock:
+                limiter.tokens.take(used - reserved)
+
+    def _backoff(self, model: str, error: Exception, attempt: int) -> float:
+        """
+        Seconds to sleep before retrying `error`, which is raised again when
+        it cannot be retried. A rate limit pauses every call to the model
+        instead, the next reservation waits it out or spills over.
+        """
+        if attempt >= self.max_retries or not _retryable(error):
+            raise error
+        LLM_RETRIES.inc(model=model, reason=type(error).__name__)
+        # Full jitter, so calls rejected together do not come back together
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, self.base_delay)
+        if not _rate_limited(error):
+            return delay
+        limiter = self.limiters.get(model)
+        with self._lock:
+            if limiter is not None:
+                limiter.pause(delay)
+            else:
+                # No limiter to block, the pause is kept per model so that
+                # repeated rate limits still add up to a fallback
+                until = time.monotonic() + delay
+                self._paused_until[model] = max(self._paused_until.get(model, 0.0), until)
+        return 0.0
+
+    async def call(
+        self, model: str, tokens: int, fn: Callable[[str], Awaitable[Any]]
+    ) -> Tuple[str, Any]:
+        """
+        Run `fn(model name)` on `model` or its fallback, returning the model
+        that answered and the result.
+        """
+        attempt = 0
+        while True:
+            name, wait = self._reserve(model, tokens)
+            if wait:
+                await asyncio.sleep(wait)
+            try:
+                return name, await fn(name)
+            except Exception as e:
+                delay = self._backoff(name, e, attempt)
+            attempt += 1
+            if delay:
+                await asyncio.sleep(delay)
+
+    def call_sync(self, model: str, tokens: int, fn: Callable[[str], Any]) -> Tuple[str, Any]:
+        """See `call`."""
+        attempt = 0
+        while True:
+            name, wait = self._reserve(model, tokens)
+            if wait:
+                time.sleep(wait)
+            try:
+                return name, fn(name)
+            except Exception as e:
+                delay = self._backoff(name, e, attempt)
+            attempt += 1
+            if delay:
+                time.sleep(delay)
+
+    async def stream(
+        self, model: str, tokens: int, fn: Callable[[str], AsyncIterator[Any]]
+    ) -> AsyncIterator[Any]:
+        """
+        Stream `fn(model name)` like `call`. Only failures before the first
+        chunk are retried, later ones would repeat what was already yielded.
+        """
+        attempt = 0
+        while True:
+            name, wait = self._reserve(model, tokens)
+            if wait:
+                await asyncio.sleep(wait)
+            started = False
+            try:
+                async for chunk in fn(name):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started:
+                    raise
+                delay = self._backoff(name, e, attempt)
+            attempt += 1
+            if delay:
+                await asyncio.sleep(delay)
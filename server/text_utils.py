@@ -0,0 +1,23 @@
+from typing import Optional, Sequence
+
+
+def format_pages(
+    page_texts: Sequence[str], page_numbers: Optional[Sequence[int]] = None
+) -> str:
+    """
+    Join per-page texts with the `Page N` markers the extraction prompt relies on.
+    Pages are numbered from 1 unless `page_numbers` is given.
+    """
+    if page_numbers is None:
+        page_numbers = range(1, len(page_texts) + 1)
+    return "\n".join(
+        f"\nPage {page_number}\n" + text
+        for page_number, text in zip(page_numbers, page_texts)
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count for budgeting, about four characters per token for English.
+    """
+    return len(text) // 4 + 1
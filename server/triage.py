@@ -0,0 +1,66 @@
+import re
+from typing import List, Optional, Sequence
+
+import pypdfium2 as pdfium
+
+from server.constants import TEXT_LAYER_MIN_CHARS, TEXT_LAYER_MIN_QUALITY
+from server.metrics import stage
+
+TOKEN_PATTERN = re.compile(r"\S+")
+# A plausible word: letters with at least one vowel, or a number or part
+# number, possibly wrapped in punctuation
+WORD_PATTERN = re.compile(
+    r"^[(\"'\[]*([A-Za-z]*[AEIOUYaeiouy][A-Za-z]*|[A-Za-z]*\d[\w.,:/-]*)[)\"'\].,;:!?%]*$"
+)
+# pdfminer's placeholder for glyphs it could not map to text
+CID_PATTERN = re.compile(r"\(cid:\d+\)")
+
+
+def text_quality(text: str, min_chars: int = TEXT_LAYER_MIN_CHARS) -> float:
+    """
+    Score a page's text layer between 0 and 1: the share of tokens that look
+    like words, times the share of characters that are printable.
+    Pages with fewer than `min_chars` characters score 0.
+    """
+    cleaned = CID_PATTERN.sub("�", text)
+    characters = [c for c in cleaned if not c.isspace()]
+    if len(characters) < min_chars:
+        return 0.0
+    printable = sum(c.isprintable() and c != "�" for c in characters)
+    tokens = TOKEN_PATTERN.findall(cleaned)
+    words = sum(1 for token in tokens if WORD_PATTERN.match(token))
+    return (words / len(tokens)) * (printable / len(characters))
+
+
+def _text_layer(page) -> str:
+    textpage = page.get_textpage()
+    try:
+        text = textpage.get_text_bounded()
+    finally:
+        textpage.close()
+    # pdfium ends lines with \r\n and marks a hyphen it found at a line end with \x02
+    return text.replace("\r\n", "\n").replace("\x02", "-\n")
+
+
+def usable_text_layers(
+    pdf_path: str,
+    min_quality: float = TEXT_LAYER_MIN_QUALITY,
+    pages: Optional[Sequence[int]] = None,
+) -> List[Optional[str]]:
+    """
+    The existing text of each page (of `pages` only, if given), or None
+    where it is missing or too garbled to use and the page needs OCR.
+    Read from pdfium's text pages, without any layout analysis.
+    """
+    layers = []
+    with stage("triage"):
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            for index in range(len(pdf)) if pages is None else pages:
+                page = pdf[index]
+                text = _text_layer(page)
+                page.close()
+                layers.append(text if text_quality(text) >= min_quality else None)
+        finally:
+            pdf.close()
+    return layers
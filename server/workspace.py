@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+from typing import Optional, Set
+from uuid import uuid4
+
+from fastapi import UploadFile
+
+from server.constants import (
+    MAX_UPLOAD_BYTES,
+    TEMP_DIR,
+    WORKSPACE_MAX_AGE,
+    WORKSPACE_SWEEP_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+# Workspaces in use by this process, never swept
+_active: Set[str] = set()
+# Room for the multipart boundaries and form fields around the file
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the configured size limit."""
+
+
+class Workspace:
+    """
+    A directory of its own under TEMP_DIR for one request's files,
+    removed with everything in it once the request is done.
+    """
+
+    def __init__(self, root: str = TEMP_DIR):
+        self.path = os.path.join(root, str(uuid4()))
+        os.makedirs(self.path)
+        _active.add(self.path)
+
+    @property
+    def input_pdf(self) -> str:
+        return self.file("input.pdf")
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        _active.discard(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+
+def body_too_large(content_length: Optional[str], max_bytes: int = MAX_UPLOAD_BYTES) -> bool:
+    """
+    Whether a request's Content-Length already rules out an upload within
+    `max_bytes`, so it can be refused before any of its body is read.
+    """
+    try:
+        return int(content_length) > max_bytes + MULTIPART_OVERHEAD
+    except (TypeError, ValueError):
+        return False
+
+
+async def spool_upload(
+    upload: UploadFile,
+    path: str,
+    max_bytes: int = MAX_UPLOAD_BYTES,
+    chunk_size: int = 1 << 20,
+) -> int:
+    """
+    Copy an upload to `path` a chunk at a time, so memory stays constant
+    whatever the file size. Raises `UploadTooLargeError` past `max_bytes`.
+    """
+    written = 0
+    with open(path, "wb") as f:
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+            written += len(chunk)
+            if written > max_bytes:
+                raise UploadTooLargeError(
+                    f"Upload exceeds the limit of {max_bytes} bytes."
+                )
+            f.write(chunk)
+    return written
+
+
+def sweep(root: str = TEMP_DIR, max_age: float = WORKSPACE_MAX_AGE) -> int:
+    """
+    Remove files and workspaces under `root` older than `max_age` seconds,
+    left behind by crashed workers or kept as artifacts. Returns how many were removed.
+    """
+    if not os.path.isdir(root):
+        return 0
+    removed = 0
+    cutoff = time.time() - max_age
+    for entry in os.scandir(root):
+        if entry.path in _active:
+            continue
+        try:
+            if entry.stat().st_mtime > cutoff:
+                continue
+            if entry.is_dir():
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+            removed += 1
+        except FileNotFoundError:
+            continue
+    return removed
+
+
+async def sweep_periodically(
+    root: str = TEMP_DIR,
+    max_age: float = WORKSPACE_MAX_AGE,
+    interval: float = WORKSPACE_SWEEP_INTERVAL,
+):
+    while True:
+        try:
+            removed = sweep(root, max_age)
+            if removed:
+                logger.info("Removed %d orphaned entries from %s", removed, root)
+        except Exception:
+            logger.exception("Sweeping %s failed", root)
+        await asyncio.sleep(interval)
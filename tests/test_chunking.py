@@ -0,0 +1,73 @@
+from server.chunking import chunk_pages, merge_extractions
+
+
+def test_chunks_end_on_page_boundaries():
+    pages = ["a" * 400, "b" * 400, "c" * 400]
+    chunks = chunk_pages(pages, token_budget=250, page_numbers=[4, 5, 6])
+    assert [[number for number, _ in chunk] for chunk in chunks] == [[4, 5], [6]]
+
+
+def test_keeps_every_issue_on_a_page():
+    merged = merge_extractions(
+        [
+            [
+                {"problem": "Belt slips", "page": 3},
+                {"problem": "Display blank", "page": 3},
+            ],
+            [{"problem": "Squeak", "page": 9}],
+        ]
+    )
+    assert merged == [
+        {"problem": "Belt slips", "page": 3},
+        {"problem": "Display blank", "page": 3},
+        {"problem": "Squeak", "page": 9},
+    ]
+
+
+def test_orders_by_page_and_drops_duplicates():
+    merged = merge_extractions(
+        [
+            [{"Issue": "Squeak", "Page": 9}, {"Issue": "Belt slips", "Page": 3}],
+            [{"Issue": "belt  SLIPS", "Page": 3}, {"Issue": "No power"}],
+        ]
+    )
+    assert merged == [
+        {"Issue": "Belt slips", "Page": 3},
+        {"Issue": "Squeak", "Page": 9},
+        {"Issue": "No power"},
+    ]
+
+
+def test_combines_page_wrappers():
+    merged = merge_extractions(
+        [
+            {
+                "Page": 2,
+                "Troubleshooting Information": [
+                    {"Issue": "Belt slips", "Solution": "Tighten the belt"},
+                    {"Issue": "Display blank", "Solution": "Replace the batteries"},
+                ],
+            },
+            [
+                {
+                    "Page": 2,
+                    "Troubleshooting Information": [
+                        {"Issue": "Display blank", "Solution": "Replace the batteries"},
+                        {"Issue": "Squeak", "Solution": "Oil the pedals"},
+                    ],
+                },
+                {"Page": 1, "Troubleshooting Information": []},
+            ],
+        ]
+    )
+    assert merged == [
+        {"Page": 1, "Troubleshooting Information": []},
+        {
+            "Page": 2,
+            "Troubleshooting Information": [
+                {"Issue": "Belt slips", "Solution": "Tighten the belt"},
+                {"Issue": "Display blank", "Solution": "Replace the batteries"},
+                {"Issue": "Squeak", "Solution": "Oil the pedals"},
+            ],
+        },
+    ]
@@ -0,0 +1,34 @@
+from server.compaction import clean_text, compact_pages
+
+BODY = [
+    "Problem: the belt slips.\nSolution: tighten the belt.",
+    "Problem: the display is blank.\nSolution: replace the batteries.",
+    "Error E2: check the motor cable.",
+    "Clean the rollers every month.",
+]
+
+
+def manual(bodies, header="ACME Treadmill T100 Service Manual"):
+    return [f"{header}\n{body}\nPage {number}" for number, body in enumerate(bodies, start=1)]
+
+
+def test_removes_running_headers_and_page_numbers():
+    texts, tokens = compact_pages(manual(BODY))
+    assert texts == BODY
+    assert tokens["tokens_after"] < tokens["tokens_before"]
+
+
+def test_keeps_pages_left_empty():
+    texts, _ = compact_pages(manual(BODY[:2] + ["", BODY[3]]))
+    assert texts == BODY[:2] + ["", BODY[3]]
+
+
+def test_needs_three_pages_to_call_a_line_repeated():
+    pages = manual(BODY[:2])
+    texts, _ = compact_pages(pages)
+    assert texts == pages
+
+
+def test_joins_words_hyphenated_across_lines():
+    assert clean_text("Check the adjust-\nment screw.") == "Check the adjustment screw."
+    assert clean_text("A self-\nContained unit.") == "A self-\nContained unit."
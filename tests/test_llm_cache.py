@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+from server.llm_cache import LLMCache, MemoryBackend, SqliteBackend, Uncached
+
+
+class FakeModel:
+    """Counts its calls, each answered after a short delay."""
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return self.answer
+
+
+def test_concurrent_identical_calls_are_coalesced():
+    cache = LLMCache(MemoryBackend(max_entries=10, ttl=60))
+    model = FakeModel([{"Page": 1}])
+
+    async def run():
+        return await asyncio.gather(*[cache.get_or_call("key", model) for _ in range(5)])
+
+    assert asyncio.run(run()) == [[{"Page": 1}]] * 5
+    assert model.calls == 1
+    assert cache.counts == {"hit": 0, "miss": 1, "coalesced": 4}
+    # stored once the call is done
+    assert asyncio.run(cache.get_or_call("key", model)) == [{"Page": 1}]
+    assert model.calls == 1
+
+
+def test_uncached_answers_are_not_stored():
+    cache = LLMCache(MemoryBackend(max_entries=10, ttl=60))
+    model = FakeModel(Uncached([{"Page": 1}]))
+    assert asyncio.run(cache.get_or_call("key", model)) == Uncached([{"Page": 1}])
+    assert asyncio.run(cache.get_or_call("key", model)) == Uncached([{"Page": 1}])
+    assert model.calls == 2
+    assert len(cache.backend) == 0
+
+
+def test_memory_backend_expires_entries(monkeypatch):
+    backend = MemoryBackend(max_entries=10, ttl=60)
+    backend.put("key", "value")
+    assert backend.get("key") == "value"
+    later = time.time() + 61
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert backend.get("key") is None
+    assert len(backend) == 0
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(max_entries=2, ttl=60)
+    backend.put("a", 1)
+    backend.put("b", 2)
+    assert backend.get("a") == 1
+    backend.put("c", 3)
+    assert backend.get("b") is None
+    assert (backend.get("a"), backend.get("c")) == (1, 3)
+
+
+def test_sqlite_backend(tmp_path, monkeypatch):
+    path = str(tmp_path / "llm.sqlite3")
+    backend = SqliteBackend(path, max_entries=2, ttl=60)
+    backend.put("a", [{"Page": 1}])
+    backend.put("b", [{"Page": 2}])
+    assert backend.get("a") == [{"Page": 1}]
+    backend.put("c", [{"Page": 3}])
+    # shared through the file
+    other = SqliteBackend(path, max_entries=2, ttl=60)
+    assert other.get("b") is None
+    assert other.get("a") == [{"Page": 1}]
+    assert len(other) == 2
+
+    later = time.time() + 61
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert other.get("a") is None
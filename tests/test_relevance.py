@@ -0,0 +1,33 @@
+from server.relevance import RelevanceFilter, select_relevant_pages
+
+TROUBLESHOOTING = (
+    "Troubleshooting. Problem: belt slips. Solution: tighten the drive belt. "
+    "Problem: display blank. Cause: battery low, replace the batteries. "
+    "Error E2: check the motor cable and reset the console."
+)
+WARRANTY = (
+    "Limited warranty. The manufacturer warrants this product to be free from "
+    "defects in material and workmanship for one year from the date of purchase."
+)
+
+
+def test_keeps_troubleshooting_pages_and_neighbours():
+    pages = [WARRANTY] * 3 + [TROUBLESHOOTING] + [WARRANTY] * 3
+    assert select_relevant_pages(pages, threshold=0.3, neighbours=1) == [2, 3, 4]
+
+
+def test_irrelevant_window_sends_nothing():
+    relevance = RelevanceFilter(threshold=0.3, neighbours=0)
+    assert relevance.select([TROUBLESHOOTING] * 2 + [WARRANTY] * 30) == [0, 1]
+    assert relevance.select([WARRANTY] * 32) == []
+
+
+def test_windows_select_what_the_whole_document_does():
+    pages = [TROUBLESHOOTING] * 2 + [WARRANTY] * 62
+    relevance = RelevanceFilter(threshold=0.3, neighbours=1)
+    windowed = [
+        first + index
+        for first in range(0, len(pages), 32)
+        for index in relevance.select(pages[first : first + 32])
+    ]
+    assert windowed == select_relevant_pages(pages, threshold=0.3, neighbours=1) == [0, 1, 2]
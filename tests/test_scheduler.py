@@ -0,0 +1,35 @@
+import random
+
+import httpx
+import openai
+
+from server.scheduler import Scheduler
+
+
+def rate_limit_error(headers=None) -> openai.RateLimitError:
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, headers=headers, request=request)
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+def test_rate_limits_pause_models_without_limits():
+    scheduler = Scheduler({}, base_delay=0)
+    assert scheduler._reserve("gpt-4-turbo", 100) == ("gpt-4-turbo", 0.0)
+    error = rate_limit_error({"retry-after": "4"})
+    assert scheduler._backoff("gpt-4-turbo", error, attempt=0) == 0.0
+    model, wait = scheduler._reserve("gpt-4-turbo", 100)
+    assert model == "gpt-4-turbo"
+    assert 3 < wait <= 4
+
+
+def test_repeated_rate_limits_fall_back_without_limits(monkeypatch):
+    # the longest backoff every time
+    monkeypatch.setattr(random, "uniform", lambda low, high: high)
+    scheduler = Scheduler({}, fallback_model="gpt-3.5-turbo", fallback_after=6, base_delay=1)
+    # 1, 2 and 4 seconds, each waited out on the model
+    for attempt in range(3):
+        scheduler._backoff("gpt-4-turbo", rate_limit_error(), attempt)
+        assert scheduler._reserve("gpt-4-turbo", 100)[0] == "gpt-4-turbo"
+    # 8 seconds is past fallback_after
+    scheduler._backoff("gpt-4-turbo", rate_limit_error(), attempt=3)
+    assert scheduler._reserve("gpt-4-turbo", 100) == ("gpt-3.5-turbo", 0.0)